@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Audio
+# Every sound is decoded once into memory when the backend starts, and plays
+# on a channel reserved for it or taken round robin from a fixed pool, so
+# starting a sound never searches for or waits on a free channel. The game
+# only ever calls play(), stop() and play_note(); NullAudio does nothing and
+# is what headless games use.
+
+from os.path import abspath, dirname
+from pygame import mixer
+
+SOUND_PATH = abspath(dirname(__file__)) + '/sounds/'
+EFFECTS = ['shoot', 'shoot2', 'invaderkilled', 'mysteryentered',
+           'mysterykilled', 'shipexplosion']
+NOTE_COUNT = 4
+EFFECT_VOLUME = 0.2
+NOTE_VOLUME = 0.5
+EFFECT_CHANNELS = 6
+
+# The mixer settings the sounds are decoded for; in Linux a 512 sample
+# buffer is not enough, 4096 prevents:
+#   ALSA lib pcm.c:7963:(snd_pcm_recover) underrun occurred
+MIXER_FREQUENCY = 44100
+MIXER_SIZE = -16
+MIXER_CHANNELS = 1
+MIXER_BUFFER = 4096
+
+
+class NullAudio(object):
+    def play(self, name, fadeout=0):
+        pass
+
+    def stop(self, name):
+        pass
+
+    def play_note(self, index):
+        pass
+
+    def quit(self):
+        pass
+
+
+NULL_AUDIO = NullAudio()
+
+
+class MixerAudio(object):
+    def __init__(self, effectChannels=EFFECT_CHANNELS):
+        mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS,
+                       MIXER_BUFFER)
+        mixer.init()
+        self.sounds = {}
+        for name in EFFECTS:
+            self.sounds[name] = mixer.Sound(SOUND_PATH + name + '.wav')
+            self.sounds[name].set_volume(EFFECT_VOLUME)
+        self.notes = []
+        for index in range(NOTE_COUNT):
+            note = mixer.Sound(SOUND_PATH + '{}.wav'.format(index))
+            note.set_volume(NOTE_VOLUME)
+            self.notes.append(note)
+
+        # Channel 0 plays the march, 1 the mystery ship, the rest effects;
+        # reserved so nothing else can take them
+        mixer.set_num_channels(effectChannels + 2)
+        mixer.set_reserved(effectChannels + 2)
+        self.noteChannel = mixer.Channel(0)
+        self.dedicated = {'mysteryentered': mixer.Channel(1)}
+        self.pool = [mixer.Channel(i + 2) for i in range(effectChannels)]
+        self.next = 0
+
+    def channel(self, name):
+        channel = self.dedicated.get(name)
+        if channel is None:
+            # The oldest effect is cut off when every channel is busy
+            channel = self.pool[self.next]
+            self.next = (self.next + 1) % len(self.pool)
+        return channel
+
+    def play(self, name, fadeout=0):
+        channel = self.channel(name)
+        channel.play(self.sounds[name])
+        if fadeout:
+            channel.fadeout(fadeout)
+
+    def stop(self, name):
+        channel = self.dedicated.get(name)
+        if channel is not None:
+            channel.stop()
+
+    def play_note(self, index):
+        self.noteChannel.play(self.notes[index])
+
+    def quit(self):
+        mixer.quit()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Autopilot
+# A scripted player cheap enough for headless soak tests. Enemy bullets fall
+# straight down at a constant speed, so each one is entered once, when it
+# first shows up, into a threat map: per BUCKET wide strip of the screen,
+# the window of frames in which a bullet can be at the ship's height. The
+# ship heads for the alive column nearest to it, fires when it is under
+# one, and never steps into a strip about to be hit.
+#
+# An Autopilot is a policy(game, frame) -> action like the bench_suite bots;
+# use one per game.
+
+from bisect import bisect_left
+
+from spaceinvaders import ACTION_FIRE, ACTION_LEFT, ACTION_NONE, ACTION_RIGHT
+from waves import ENEMY_WIDTH
+
+BUCKET = 8
+SCREEN_WIDTH = 800
+SHIP_MIN_X = 10
+SHIP_MAX_X = 740
+# Offset of the ship's shot from its left edge
+GUN_OFFSET = 23
+# Frames of warning the ship needs to clear a strip it is standing in
+ESCAPE_FRAMES = 12
+NEVER = 1 << 30
+
+
+class Autopilot(object):
+    def __init__(self):
+        self.game = None
+        self.now = 0
+        count = SCREEN_WIDTH // BUCKET + 1
+        # Per strip, the earliest frame a tracked bullet reaches the ship's
+        # height and the last frame one is still there
+        self.enter = [NEVER] * count
+        self.exit = [-1] * count
+        # Bullet -> (x, y, frame seen, first strip, last strip, enter, exit)
+        self.tracked = {}
+
+    def reset(self, game):
+        self.game = game
+        self.enter[:] = [NEVER] * len(self.enter)
+        self.exit[:] = [-1] * len(self.exit)
+        self.tracked.clear()
+
+    def __call__(self, game, frame):
+        now = game.clock.frame
+        if game is not self.game or now < self.now:
+            self.reset(game)
+        self.now = now
+        self.track(game, now)
+        if not game.shipAlive:
+            return ACTION_NONE
+
+        ship = game.player.rect
+        target = self.target(game, ship)
+        action = ACTION_NONE
+        if target is not None and abs(ship.x + GUN_OFFSET - target) <= 2:
+            action = ACTION_FIRE
+        return action | self.move(ship, target, now)
+
+    def track(self, game, now):
+        # Enters new bullets into the map and drops the ones that are gone;
+        # a pooled bullet reused for a new shot is off its old course
+        tracked = self.tracked
+        if not tracked and not game.enemyBullets:
+            return
+        bullets = game.enemyBullets.sprites()
+        for bullet in bullets:
+            entry = tracked.get(bullet)
+            rect = bullet.rect
+            if entry is not None:
+                if entry[0] == rect.x and \
+                        entry[1] + bullet.speed * (now - entry[2]) == rect.y:
+                    continue
+                self.untrack(bullet)
+            self.add(bullet, game.player.rect, now)
+        if len(tracked) > len(bullets):
+            alive = set(bullets)
+            for bullet in [b for b in tracked if b not in alive]:
+                self.untrack(bullet)
+
+    def add(self, bullet, ship, now):
+        rect = bullet.rect
+        speed = bullet.speed * bullet.direction
+        if speed <= 0:
+            return
+        enter = now + (ship.top - rect.bottom) // speed
+        exit = now + (ship.bottom - rect.top) // speed + 1
+        first = max(rect.left // BUCKET, 0)
+        last = min((rect.right - 1) // BUCKET, len(self.enter) - 1)
+        self.tracked[bullet] = (rect.x, rect.y, now, first, last, enter, exit)
+        for strip in range(first, last + 1):
+            if enter < self.enter[strip]:
+                self.enter[strip] = enter
+            if exit > self.exit[strip]:
+                self.exit[strip] = exit
+
+    def untrack(self, bullet):
+        first, last = self.tracked.pop(bullet)[3:5]
+        for strip in range(first, last + 1):
+            enter = NEVER
+            exit = -1
+            for other in self.tracked.values():
+                if other[3] <= strip <= other[4]:
+                    enter = min(enter, other[5])
+                    exit = max(exit, other[6])
+            self.enter[strip] = enter
+            self.exit[strip] = exit
+
+    def danger(self, x, width, now):
+        # Frames until a bullet can reach a ship at x, NEVER if none will
+        soonest = NEVER
+        for strip in range(max(x // BUCKET, 0),
+                           min((x + width - 1) // BUCKET,
+                               len(self.enter) - 1) + 1):
+            if self.exit[strip] >= now and self.enter[strip] < soonest:
+                soonest = self.enter[strip]
+        return max(soonest - now, 0) if soonest != NEVER else NEVER
+
+    def target(self, game, ship):
+        # Centre of the alive column nearest to the ship's gun
+        enemies = game.enemies
+        columns = enemies._aliveColumns
+        if not columns:
+            return None
+        offsets = enemies.wave.columnOffsets
+        left = enemies.x + enemies.offsetX + ENEMY_WIDTH // 2
+        gun = ship.x + GUN_OFFSET - left
+        index = bisect_left(columns, gun // enemies.wave.spacingX)
+        if index == len(columns):
+            return left + offsets[columns[-1]]
+        best = offsets[columns[index]]
+        if index and gun - offsets[columns[index - 1]] < best - gun:
+            best = offsets[columns[index - 1]]
+        return left + best
+
+    def move(self, ship, target, now):
+        # Steps towards the target when that is safe, otherwise to the
+        # neighbouring position that is safe the longest
+        speed = self.game.player.speed
+        x = ship.x
+        goal = x if target is None else target - GUN_OFFSET
+        toward = ACTION_NONE
+        if goal < x - speed // 2 and x > SHIP_MIN_X:
+            toward = ACTION_LEFT
+        elif goal > x + speed // 2 and x < SHIP_MAX_X:
+            toward = ACTION_RIGHT
+        if not self.tracked or self.danger(
+                x - speed, ship.width + 2 * speed, now) > ESCAPE_FRAMES:
+            # Nothing threatens any of the options
+            return toward
+
+        options = [(ACTION_NONE, x)]
+        if x > SHIP_MIN_X:
+            options.append((ACTION_LEFT, x - speed))
+        if x < SHIP_MAX_X:
+            options.append((ACTION_RIGHT, x + speed))
+        best = None
+        for action, position in options:
+            danger = min(self.danger(position, ship.width, now),
+                         ESCAPE_FRAMES + 1)
+            key = (-danger, action != toward)
+            if best is None or key < best[0]:
+                best = (key, action)
+        if best[0][0] < -ESCAPE_FRAMES:
+            return best[1]
+        return self.escape(ship, now)
+
+    def escape(self, ship, now):
+        # Every position is about to be hit; head for the nearest safe one
+        for distance in range(BUCKET, SCREEN_WIDTH, BUCKET):
+            for action, x in ((ACTION_LEFT, ship.x - distance),
+                              (ACTION_RIGHT, ship.x + distance)):
+                if SHIP_MIN_X <= x <= SHIP_MAX_X and \
+                        self.danger(x, ship.width, now) > ESCAPE_FRAMES:
+                    return action
+        return ACTION_NONE
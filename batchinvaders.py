@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+
+# Space Invaders, batched
+# Steps N independent games at once. Each game's state is a row in a set of
+# NumPy arrays (struct of arrays) instead of a graph of sprites, so one call
+# to step() moves, collides and scores every instance. The rules mirror
+# SpaceInvaders.step exactly: the same seed and actions give the same game.
+
+import numpy as np
+from random import Random
+
+from spaceinvaders import (IMAGES, BLOCKERS_POSITION, BLOCKER_SIZE, FPS,
+                           ACTION_LEFT, ACTION_RIGHT, ACTION_FIRE)
+from waves import ENEMY_HEIGHT, ENEMY_WIDTH
+
+# The batch engine only plays the classic wave of waves/default.json
+ENEMY_DEFAULT_POSITION = 65
+ENEMY_MOVE_DOWN = 35
+ROWS = 5
+COLUMNS = 10
+ROW_SCORES = np.array([30, 20, 20, 10, 10])
+MYSTERY_SCORES = [50, 100, 150, 300]
+
+SHIP_Y = 540
+SHIP_WIDTH, SHIP_HEIGHT = IMAGES['ship'].get_size()
+LASER_WIDTH, LASER_HEIGHT = IMAGES['laser'].get_size()
+ENEMY_LASER_WIDTH, ENEMY_LASER_HEIGHT = IMAGES['enemylaser'].get_size()
+MYSTERY_Y = 45
+MYSTERY_WIDTH, MYSTERY_HEIGHT = 75, 35
+
+# Blockers: 4 shields of 4x9 cells, stored as one 36 bit row mask per
+# cell row (bit = shield * 9 + column)
+BLOCKER_ROWS = 4
+BLOCKER_COLUMNS = 36
+FULL_BLOCKER_ROW = np.uint64((1 << BLOCKER_COLUMNS) - 1)
+BLOCKER_X = np.array([50 + (200 * (c // 9)) + ((c % 9) * BLOCKER_SIZE)
+                      for c in range(BLOCKER_COLUMNS)])
+BLOCKER_Y = np.array([BLOCKERS_POSITION + (r * BLOCKER_SIZE)
+                      for r in range(BLOCKER_ROWS)])
+
+EXPLOSION_TIMES = {'enemy': 400, 'mystery': 600, 'ship': 900}
+ENEMY_BULLET_CAPACITY = 8
+LUT_LOW = -64
+LUT_HIGH = 896
+
+
+def _overlaps(a, a_size, b, b_size):
+    # Same test as Rect.colliderect along one axis
+    return (a < b + b_size) & (b < a + a_size)
+
+
+def _column_lut(width):
+    # Blocker columns touched by a rect of this width, for every x position
+    xs = np.arange(LUT_LOW, LUT_HIGH)
+    hits = _overlaps(xs[:, None], width, BLOCKER_X[None, :], BLOCKER_SIZE)
+    bits = np.uint64(1) << np.arange(BLOCKER_COLUMNS, dtype=np.uint64)
+    return np.bitwise_or.reduce(np.where(hits, bits, np.uint64(0)), axis=1)
+
+
+def _row_lut(height):
+    ys = np.arange(LUT_LOW, LUT_HIGH)
+    return _overlaps(ys[:, None], height, BLOCKER_Y[None, :], BLOCKER_SIZE)
+
+
+def _lut_index(pos):
+    return np.clip(pos - LUT_LOW, 0, LUT_HIGH - LUT_LOW - 1)
+
+
+LASER_COLUMNS = _column_lut(LASER_WIDTH)
+LASER_ROWS = _row_lut(LASER_HEIGHT)
+ENEMY_LASER_COLUMNS = _column_lut(ENEMY_LASER_WIDTH)
+ENEMY_LASER_ROWS = _row_lut(ENEMY_LASER_HEIGHT)
+ENEMY_COLUMNS = _column_lut(ENEMY_WIDTH)
+ENEMY_ROWS = _row_lut(ENEMY_HEIGHT)
+
+
+class BatchSpaceInvaders(object):
+    def __init__(self, size, seeds=None):
+        self.size = size
+        if seeds is None:
+            seeds = [None] * size
+        if len(seeds) != size:
+            raise ValueError('expected {} seeds, got {}'.format(size,
+                                                                len(seeds)))
+        self.randoms = [Random(seed) for seed in seeds]
+        n = size
+        self.frame = np.zeros(n, np.int64)
+        self.score = np.zeros(n, np.int64)
+        self.lives = np.zeros(n, np.int64)
+        self.gameOver = np.zeros(n, bool)
+        self.gameTimer = np.zeros(n, np.int64)
+        self.enemyPosition = np.zeros(n, np.int64)
+        self.timer = np.zeros(n, np.int64)
+
+        self.shipX = np.zeros(n, np.int64)
+        self.playerAlive = np.zeros(n, bool)
+        self.shipAlive = np.zeros(n, bool)
+        self.makeNewShip = np.zeros(n, bool)
+        self.shipTimer = np.zeros(n, np.int64)
+
+        self.mysteryX = np.zeros(n, np.int64)
+        self.mysteryDirection = np.zeros(n, np.int64)
+        self.mysteryTimer = np.zeros(n, np.int64)
+
+        # Formation: alive grid plus a shared offset for all enemies
+        self.alive = np.zeros((n, ROWS, COLUMNS), bool)
+        self.columnCount = np.zeros((n, COLUMNS), np.int64)
+        self.enemyCount = np.zeros(n, np.int64)
+        self.offsetX = np.zeros(n, np.int64)
+        self.offsetY = np.zeros(n, np.int64)
+        self.direction = np.zeros(n, np.int64)
+        self.moveNumber = np.zeros(n, np.int64)
+        self.leftMoves = np.zeros(n, np.int64)
+        self.rightMoves = np.zeros(n, np.int64)
+        self.leftAddMove = np.zeros(n, np.int64)
+        self.rightAddMove = np.zeros(n, np.int64)
+        self.moveTime = np.zeros(n, np.int64)
+        self.enemyTimer = np.zeros(n, np.int64)
+        self.bottom = np.zeros(n, np.int64)
+        self.leftAliveColumn = np.zeros(n, np.int64)
+        self.rightAliveColumn = np.zeros(n, np.int64)
+
+        # Bullets live in fixed capacity slots, kept in firing order
+        self.bulletAlive = np.zeros((n, 2), bool)
+        self.bulletX = np.zeros((n, 2), np.int64)
+        self.bulletY = np.zeros((n, 2), np.int64)
+        self.enemyBulletAlive = np.zeros((n, ENEMY_BULLET_CAPACITY), bool)
+        self.enemyBulletX = np.zeros((n, ENEMY_BULLET_CAPACITY), np.int64)
+        self.enemyBulletY = np.zeros((n, ENEMY_BULLET_CAPACITY), np.int64)
+
+        self.blockers = np.zeros((n, BLOCKER_ROWS), np.uint64)
+
+        # Only the latest explosion end matters for the next round check
+        self.explosionsUntil = np.zeros(n, np.int64)
+        self.hasExplosions = np.zeros(n, bool)
+
+        self.new_game(np.ones(n, bool))
+
+    def get_ticks(self):
+        return self.frame * 1000 // FPS
+
+    def new_game(self, mask):
+        t = self.get_ticks()
+        self.blockers[mask] = FULL_BLOCKER_ROW
+        self.enemyPosition[mask] = ENEMY_DEFAULT_POSITION
+        self.lives[mask] = 3
+        self.gameOver[mask] = False
+        self.score[mask] = 0
+        self.reset(mask, t)
+        self.gameTimer[mask] = t[mask]
+
+    def reset(self, mask, t):
+        self.shipX[mask] = 375
+        self.playerAlive[mask] = True
+        self.shipAlive[mask] = True
+        self.makeNewShip[mask] = False
+        self.explosionsUntil[mask] = 0
+        self.hasExplosions[mask] = False
+        self.bulletAlive[mask] = False
+        self.enemyBulletAlive[mask] = False
+
+        self.mysteryX[mask] = -80
+        self.mysteryDirection[mask] = 1
+        self.mysteryTimer[mask] = t[mask]
+
+        self.alive[mask] = True
+        self.columnCount[mask] = ROWS
+        self.enemyCount[mask] = ROWS * COLUMNS
+        self.offsetX[mask] = 0
+        self.offsetY[mask] = 0
+        self.direction[mask] = 1
+        self.moveNumber[mask] = 15
+        self.leftMoves[mask] = 30
+        self.rightMoves[mask] = 30
+        self.leftAddMove[mask] = 0
+        self.rightAddMove[mask] = 0
+        self.moveTime[mask] = 600
+        self.enemyTimer[mask] = t[mask]
+        self.bottom[mask] = (self.enemyPosition[mask] + ((ROWS - 1) * 45) +
+                             ENEMY_HEIGHT)
+        self.leftAliveColumn[mask] = 0
+        self.rightAliveColumn[mask] = COLUMNS - 1
+
+        self.timer[mask] = t[mask]
+        self.shipTimer[mask] = t[mask]
+
+    def enemy_x(self):
+        return 157 + (np.arange(COLUMNS) * 50)[None, :] + self.offsetX[:, None]
+
+    def enemy_y(self):
+        return (self.enemyPosition[:, None] + (np.arange(ROWS) * 45)[None, :] +
+                self.offsetY[:, None])
+
+    def step(self, actions):
+        # Advance every game by one frame; returns (rewards, dones)
+        actions = np.asarray(actions)
+        score = self.score.copy()
+        live = ~self.gameOver
+        t = self.get_ticks()
+        roundOver = live & (self.enemyCount == 0) & ~self.hasExplosions
+        nextRound = roundOver & (t - self.gameTimer > 3000)
+        if nextRound.any():
+            # Move enemies closer to bottom
+            self.enemyPosition[nextRound] += ENEMY_MOVE_DOWN
+            self.reset(nextRound, t)
+            self.gameTimer[nextRound] += 3000
+        play = live & ~roundOver
+        if play.any():
+            self.check_input(play, actions)
+            self.update_enemies(play, t)
+            self.update_ship(play, actions)
+            self.update_mystery(play, t)
+            self.update_bullets(play)
+            self.hasExplosions[play] = self.explosionsUntil[play] >= t[play]
+            self.check_collisions(play, t)
+            self.create_new_ship(play, t)
+            self.make_enemies_shoot(play, t)
+        self.frame[live] += 1
+        return self.score - score, self.gameOver.copy()
+
+    def check_input(self, play, actions):
+        fire = (play & ((actions & ACTION_FIRE) != 0) &
+                ~self.bulletAlive.any(axis=1) & self.shipAlive)
+        single = fire & (self.score < 1000)
+        double = fire & ~single
+        self.bulletAlive[single, 0] = True
+        self.bulletX[single, 0] = self.shipX[single] + 23
+        self.bulletAlive[double] = True
+        self.bulletX[double, 0] = self.shipX[double] + 8
+        self.bulletX[double, 1] = self.shipX[double] + 38
+        self.bulletY[fire] = SHIP_Y + 5
+
+    def update_enemies(self, play, t):
+        move = play & (t - self.enemyTimer > self.moveTime)
+        maxMove = np.where(self.direction == 1,
+                           self.rightMoves + self.rightAddMove,
+                           self.leftMoves + self.leftAddMove)
+        down = move & (self.moveNumber >= maxMove)
+        side = move & ~down
+
+        leftMoves = 30 + self.rightAddMove
+        self.rightMoves[down] = 30 + self.leftAddMove[down]
+        self.leftMoves[down] = leftMoves[down]
+        self.direction[down] *= -1
+        self.moveNumber[down] = 0
+        self.offsetY[down] += ENEMY_MOVE_DOWN
+        rowsAlive = self.alive.any(axis=2)
+        lowestRow = ROWS - 1 - np.argmax(rowsAlive[:, ::-1], axis=1)
+        bottom = np.where(rowsAlive.any(axis=1),
+                          self.enemyPosition + (lowestRow * 45) +
+                          self.offsetY + ENEMY_HEIGHT, 0)
+        self.bottom[down] = bottom[down]
+
+        self.offsetX[side] += 10 * self.direction[side]
+        self.moveNumber[side] += 1
+
+        self.enemyTimer[move] += self.moveTime[move]
+
+    def update_ship(self, play, actions):
+        moving = play & self.playerAlive
+        left = moving & ((actions & ACTION_LEFT) != 0) & (self.shipX > 10)
+        self.shipX[left] -= 5
+        right = moving & ((actions & ACTION_RIGHT) != 0) & (self.shipX < 740)
+        self.shipX[right] += 5
+
+    def update_mystery(self, play, t):
+        waited = play & (t - self.mysteryTimer > 25000)
+        forward = waited & (self.mysteryX < 840) & (self.mysteryDirection == 1)
+        self.mysteryX[forward] += 2
+        back = waited & (self.mysteryX > -100) & (self.mysteryDirection == -1)
+        self.mysteryX[back] -= 2
+
+        right = play & (self.mysteryX > 830)
+        self.mysteryDirection[right] = -1
+        left = play & (self.mysteryX < -90)
+        self.mysteryDirection[left] = 1
+        self.mysteryTimer[waited & (right | left)] = t[waited & (right | left)]
+
+    def update_bullets(self, play):
+        moving = play[:, None] & self.bulletAlive
+        self.bulletY[moving] -= 15
+        self.bulletAlive &= ~(moving & ((self.bulletY < 15) |
+                                        (self.bulletY > 600)))
+        moving = play[:, None] & self.enemyBulletAlive
+        self.enemyBulletY[moving] += 5
+        self.enemyBulletAlive &= ~(moving & ((self.enemyBulletY < 15) |
+                                             (self.enemyBulletY > 600)))
+
+    def kill_enemy(self, mask, index):
+        # Mirrors EnemiesGroup.kill, including its edge column bookkeeping
+        idx = np.flatnonzero(mask)
+        if not len(idx):
+            return
+        row, column = np.divmod(index[idx], COLUMNS)
+        self.alive[idx, row, column] = False
+        self.columnCount[idx, column] -= 1
+        self.enemyCount[idx] -= 1
+        dead = self.columnCount[idx, column] == 0
+
+        hasColumns = self.columnCount[idx] > 0
+        rightmost = np.where(hasColumns.any(axis=1),
+                             COLUMNS - 1 - np.argmax(hasColumns[:, ::-1],
+                                                     axis=1), 0)
+        leftmost = np.argmax(hasColumns, axis=1)
+        isRight = column == self.rightAliveColumn[idx]
+        isLeft = ~isRight & (column == self.leftAliveColumn[idx])
+
+        r = idx[dead & isRight]
+        newRight = rightmost[dead & isRight]
+        self.rightAddMove[r] += 5 * (self.rightAliveColumn[r] - newRight)
+        self.rightAliveColumn[r] = newRight
+        l = idx[dead & isLeft]
+        newLeft = leftmost[dead & isLeft]
+        self.leftAddMove[l] += 5 * (newLeft - self.leftAliveColumn[l])
+        self.leftAliveColumn[l] = newLeft
+
+        count = self.enemyCount[idx]
+        self.moveTime[idx[count == 1]] = 200
+        self.moveTime[idx[(count != 1) & (count <= 10)]] = 400
+
+    def add_explosion(self, mask, t, kind):
+        end = t + EXPLOSION_TIMES[kind]
+        self.explosionsUntil[mask] = np.maximum(self.explosionsUntil[mask],
+                                                end[mask])
+        self.hasExplosions |= mask
+
+    def check_collisions(self, play, t):
+        bulletX, bulletY = self.bulletX, self.bulletY
+        enemyBulletX, enemyBulletY = self.enemyBulletX, self.enemyBulletY
+
+        # Player bullets against enemy bullets, in firing order
+        for b in range(2):
+            hits = (self.enemyBulletAlive & play[:, None] &
+                    self.bulletAlive[:, b, None] &
+                    _overlaps(bulletX[:, b, None], LASER_WIDTH,
+                              enemyBulletX, ENEMY_LASER_WIDTH) &
+                    _overlaps(bulletY[:, b, None], LASER_HEIGHT,
+                              enemyBulletY, ENEMY_LASER_HEIGHT))
+            self.enemyBulletAlive &= ~hits
+            self.bulletAlive[:, b] &= ~hits.any(axis=1)
+
+        # Player bullets against enemies, first enemy in row major order
+        enemyX, enemyY = self.enemy_x(), self.enemy_y()
+        overlap = (self.bulletAlive[:, :, None, None] &
+                   play[:, None, None, None] &
+                   self.alive[:, None, :, :] &
+                   _overlaps(bulletX[:, :, None, None], LASER_WIDTH,
+                             enemyX[:, None, None, :], ENEMY_WIDTH) &
+                   _overlaps(bulletY[:, :, None, None], LASER_HEIGHT,
+                             enemyY[:, None, :, None], ENEMY_HEIGHT))
+        overlap = overlap.reshape(self.size, 2, ROWS * COLUMNS)
+        hitAny = overlap.any(axis=1)
+        firstHit = hitAny.any(axis=1)
+        first = np.argmax(hitAny, axis=1)
+        n = np.arange(self.size)
+        spent = overlap[n, :, first] & firstHit[:, None]
+        remaining = self.bulletAlive & ~spent
+        self.bulletAlive &= ~spent
+        second = overlap & remaining[:, :, None]
+        secondHit = second.any(axis=2).any(axis=1)
+        secondBullet = np.argmax(second.any(axis=2), axis=1)
+        secondIndex = np.argmax(second[n, secondBullet], axis=1)
+        self.bulletAlive[n[secondHit], secondBullet[secondHit]] = False
+
+        for mask, index in ((firstHit, first), (secondHit, secondIndex)):
+            self.kill_enemy(mask, index)
+            self.score[mask] += ROW_SCORES[index // COLUMNS][mask]
+            self.add_explosion(mask, t, 'enemy')
+            self.gameTimer[mask] = t[mask]
+
+        # Player bullets against the mystery ship
+        hits = (self.bulletAlive & play[:, None] &
+                _overlaps(bulletX, LASER_WIDTH,
+                          self.mysteryX[:, None], MYSTERY_WIDTH) &
+                _overlaps(bulletY, LASER_HEIGHT, MYSTERY_Y, MYSTERY_HEIGHT))
+        self.bulletAlive &= ~hits
+        mystery = hits.any(axis=1)
+        for i in np.flatnonzero(mystery):
+            self.score[i] += self.randoms[i].choice(MYSTERY_SCORES)
+        self.add_explosion(mystery, t, 'mystery')
+        self.mysteryX[mystery] = -80
+        self.mysteryDirection[mystery] = 1
+        self.mysteryTimer[mystery] = t[mystery]
+
+        # Enemy bullets against the player
+        hits = (self.enemyBulletAlive & (play & self.playerAlive)[:, None] &
+                _overlaps(enemyBulletX, ENEMY_LASER_WIDTH,
+                          self.shipX[:, None], SHIP_WIDTH) &
+                _overlaps(enemyBulletY, ENEMY_LASER_HEIGHT,
+                          SHIP_Y, SHIP_HEIGHT))
+        self.enemyBulletAlive &= ~hits
+        shot = hits.any(axis=1)
+        self.gameOver |= shot & (self.lives == 0)
+        self.lives[shot & (self.lives > 0)] -= 1
+        self.add_explosion(shot, t, 'ship')
+        self.makeNewShip |= shot
+        self.shipTimer[shot] = t[shot]
+        self.shipAlive &= ~shot
+        self.playerAlive &= ~shot
+
+        # Enemies reaching the player
+        low = play & (self.bottom >= 540)
+        crash = (self.alive & (low & self.playerAlive)[:, None, None] &
+                 _overlaps(enemyX[:, None, :], ENEMY_WIDTH,
+                           self.shipX[:, None, None], SHIP_WIDTH) &
+                 _overlaps(enemyY[:, :, None], ENEMY_HEIGHT,
+                           SHIP_Y, SHIP_HEIGHT)).reshape(self.size, -1)
+        crashed = crash.any(axis=1)
+        self.kill_enemy(crashed, np.argmax(crash, axis=1))
+        self.playerAlive &= ~crashed
+        self.gameOver |= low & (~self.playerAlive | (self.bottom >= 600))
+
+        # Bullets against blockers, in firing order
+        for b in range(2):
+            active = play & self.bulletAlive[:, b]
+            self.bulletAlive[:, b] &= ~self.erode_blockers(
+                active, LASER_COLUMNS, LASER_ROWS,
+                bulletX[:, b], bulletY[:, b])
+        for b in range(ENEMY_BULLET_CAPACITY):
+            active = play & self.enemyBulletAlive[:, b]
+            if active.any():
+                self.enemyBulletAlive[:, b] &= ~self.erode_blockers(
+                    active, ENEMY_LASER_COLUMNS, ENEMY_LASER_ROWS,
+                    enemyBulletX[:, b], enemyBulletY[:, b])
+
+        # Enemies eat through blockers once low enough
+        low = play & (self.bottom >= BLOCKERS_POSITION)
+        if low.any():
+            columns = ENEMY_COLUMNS[_lut_index(enemyX)]
+            eaten = np.zeros_like(self.blockers)
+            for row in range(ROWS):
+                rowColumns = np.bitwise_or.reduce(
+                    np.where(self.alive[:, row], columns, np.uint64(0)),
+                    axis=1)
+                rows = ENEMY_ROWS[_lut_index(enemyY[:, row])] & low[:, None]
+                eaten |= np.where(rows, rowColumns[:, None], np.uint64(0))
+            self.blockers &= ~eaten
+
+    def erode_blockers(self, active, column_lut, row_lut, x, y):
+        columns = column_lut[_lut_index(x)]
+        rows = row_lut[_lut_index(y)] & active[:, None]
+        cells = np.where(rows, columns[:, None], np.uint64(0))
+        hit = (self.blockers & cells).any(axis=1)
+        self.blockers &= ~cells
+        return hit
+
+    def create_new_ship(self, play, t):
+        spawn = play & self.makeNewShip & (t - self.shipTimer > 900)
+        self.shipX[spawn] = 375
+        self.playerAlive |= spawn
+        self.makeNewShip &= ~spawn
+        self.shipAlive |= spawn
+
+    def make_enemies_shoot(self, play, t):
+        shoot = play & (t - self.timer > 700) & (self.enemyCount > 0)
+        for i in np.flatnonzero(shoot):
+            column = self.randoms[i].choice(
+                np.flatnonzero(self.columnCount[i]))
+            row = ROWS - 1 - np.argmax(self.alive[i, ::-1, column])
+            alive = np.flatnonzero(self.enemyBulletAlive[i])
+            count = len(alive)
+            if count == ENEMY_BULLET_CAPACITY:
+                raise RuntimeError('enemy bullet capacity exceeded')
+            self.enemyBulletX[i, :count] = self.enemyBulletX[i, alive]
+            self.enemyBulletY[i, :count] = self.enemyBulletY[i, alive]
+            self.enemyBulletAlive[i] = (np.arange(ENEMY_BULLET_CAPACITY) <=
+                                        count)
+            self.enemyBulletX[i, count] = (157 + (column * 50) +
+                                           self.offsetX[i] + 14)
+            self.enemyBulletY[i, count] = (self.enemyPosition[i] + (row * 45) +
+                                           self.offsetY[i] + 20)
+            self.timer[i] = t[i]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Startup benchmark
+# Times cold starts in fresh interpreters: importing the game, creating it
+# and running the first headless step, and bringing up a window and
+# presenting the first rendered frame. Phases are cumulative from the first
+# line of the child script; "process" also includes interpreter startup.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+from statistics import median
+
+BASE_PATH = abspath(dirname(__file__))
+
+HEADLESS = '''
+import json, time
+start = time.perf_counter()
+import spaceinvaders
+imported = time.perf_counter()
+game = spaceinvaders.SpaceInvaders()
+game.step()
+stepped = time.perf_counter()
+print(json.dumps({'import': imported - start,
+                  'first_step': stepped - start}))
+'''
+
+RENDERED = '''
+import json, time
+start = time.perf_counter()
+import spaceinvaders
+imported = time.perf_counter()
+app = spaceinvaders.App()
+app.game.step()
+app.renderer.draw_game(app.game)
+app.renderer.update_display()
+drawn = time.perf_counter()
+print(json.dumps({'import': imported - start,
+                  'first_frame': drawn - start}))
+'''
+
+
+def run(script, env):
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=BASE_PATH, env=env,
+                                     universal_newlines=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - start
+    return result
+
+
+def benchmark(runs, video_driver=None, rendered=True):
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    if video_driver:
+        env['SDL_VIDEODRIVER'] = video_driver
+    samples = {}
+    scripts = [('headless', HEADLESS)]
+    if rendered:
+        scripts.append(('rendered', RENDERED))
+    for name, script in scripts:
+        for _ in range(runs):
+            for phase, seconds in run(script, env).items():
+                samples.setdefault('{} {}'.format(name, phase),
+                                   []).append(seconds)
+    return dict((name, {'median': median(values), 'min': min(values),
+                        'max': max(values)})
+                for name, values in samples.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Space Invaders startup '
+                                                 'benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--video-driver',
+                        help='SDL video driver, e.g. "dummy" on machines '
+                             'without a display')
+    parser.add_argument('--headless-only', action='store_true',
+                        help='skip the first rendered frame timing')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    results = benchmark(args.runs, args.video_driver,
+                        not args.headless_only)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for name in sorted(results):
+            stats = results[name]
+            print('{:<24} {:8.1f} ms  (min {:.1f}, max {:.1f})'.format(
+                name, stats['median'] * 1000, stats['min'] * 1000,
+                stats['max'] * 1000))
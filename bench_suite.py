@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Scenario benchmarks
+# Drives seeded games through scripted scenarios and reports, per scenario,
+# headless steps/sec, rendered frames/sec, allocation churn and peak traced
+# memory. Results can be saved as a baseline; later runs compared against it
+# exit non-zero when a metric regresses by more than the threshold.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import spaceinvaders
+from spaceinvaders import (ACTION_FIRE, ACTION_LEFT, ACTION_RIGHT,
+                           SpaceInvaders)
+from waves import WAVE_PATH, load_waves
+
+SEED = 1
+FRAMES = 3000
+THRESHOLD = 0.10
+# Metric name -> True when higher is better
+METRICS = OrderedDict([('steps_per_sec', True), ('frames_per_sec', True),
+                       ('gc_collections', False), ('peak_memory_kb', False)])
+
+
+def sweep(game, frame):
+    # Fire constantly while sweeping across the screen every two seconds
+    if (frame // 120) % 2:
+        return ACTION_FIRE | ACTION_LEFT
+    return ACTION_FIRE | ACTION_RIGHT
+
+
+def track_mystery(game, frame):
+    # Stay under the mystery ship while it is on screen
+    if not game.mysteryGroup or not game.shipAlive:
+        return sweep(game, frame)
+    target = game.mysteryShip.rect.centerx
+    ship = game.player.rect.centerx
+    if target < ship - 5:
+        return ACTION_FIRE | ACTION_LEFT
+    if target > ship + 5:
+        return ACTION_FIRE | ACTION_RIGHT
+    return ACTION_FIRE
+
+
+def bullet_storm(game, frame):
+    # Enemies shoot every frame instead of every 700 ms
+    game.timer = game.clock.get_ticks() - 701
+    return sweep(game, frame)
+
+
+def start_late(game):
+    game.round = 5
+    game.enemyPosition = game.waves.position(game.round)
+    game.reset(game.score)
+
+
+def start_double_shot(game):
+    game.score = 1000
+
+
+def start_swarm(game):
+    # Thousands of enemies in one formation
+    swarm = load_waves(WAVE_PATH + 'swarm.json')
+    if game.waves is not swarm:
+        game.waves = swarm
+        game.new_game()
+
+
+# Name -> (setup after every new game, per-frame policy)
+SCENARIOS = OrderedDict([
+    ('first_wave', (None, sweep)),
+    ('late_round', (start_late, sweep)),
+    ('double_shot', (start_double_shot, sweep)),
+    ('mystery', (None, track_mystery)),
+    ('stress', (start_double_shot, bullet_storm)),
+    ('swarm', (start_swarm, sweep)),
+])
+
+
+def play(scenario, frames, seed=SEED, renderer=None):
+    setup, policy = SCENARIOS[scenario]
+    game = SpaceInvaders(seed=seed)
+    if setup is not None:
+        setup(game)
+    for frame in range(frames):
+        reward, done = game.step(policy(game, frame))
+        if renderer is not None:
+            renderer.draw_game(game)
+            renderer.update_display()
+        if done:
+            game.new_game()
+            if setup is not None:
+                setup(game)
+    return game
+
+
+def timed(scenario, frames, repeat, renderer=None):
+    # Best of several runs, the least disturbed by the rest of the machine
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        play(scenario, frames, renderer=renderer)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return frames / best
+
+
+def memory(scenario, frames):
+    gc.collect()
+    collections = sum(stats['collections'] for stats in gc.get_stats())
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        game = play(scenario, frames)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return OrderedDict([
+        ('gc_collections',
+         sum(stats['collections'] for stats in gc.get_stats()) - collections),
+        ('allocated_blocks', sys.getallocatedblocks() - blocks),
+        ('peak_memory_kb', round(peak / 1024.0, 1)),
+        ('score', game.score),
+    ])
+
+
+def make_renderer(video_driver=None, dirty=False):
+    if video_driver:
+        os.environ['SDL_VIDEODRIVER'] = video_driver
+    spaceinvaders.display.init()
+    spaceinvaders.font.init()
+    screen = spaceinvaders.display.set_mode((800, 600))
+    spaceinvaders.convert_images()
+    return spaceinvaders.Renderer(screen, dirty)
+
+
+def benchmark(scenarios, frames=FRAMES, repeat=3, renderer=None):
+    results = OrderedDict()
+    for name in scenarios:
+        result = OrderedDict()
+        result['steps_per_sec'] = round(timed(name, frames, repeat), 1)
+        if renderer is not None:
+            result['frames_per_sec'] = round(
+                timed(name, frames, 1, renderer), 1)
+        result.update(memory(name, frames))
+        results[name] = result
+    return results
+
+
+def regressions(results, baseline, threshold=THRESHOLD):
+    found = []
+    for name, result in results.items():
+        for metric, higher in METRICS.items():
+            if metric not in result or \
+                    metric not in baseline.get(name, {}):
+                continue
+            old = baseline[name][metric]
+            new = result[metric]
+            if higher:
+                worse = new < old * (1 - threshold)
+            else:
+                worse = new > max(old, 1) * (1 + threshold)
+            if worse:
+                found.append('{} {}: {} -> {}'.format(name, metric, old, new))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Space Invaders scenario '
+                                                 'benchmarks')
+    parser.add_argument('--scenario', action='append',
+                        choices=list(SCENARIOS),
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--frames', type=int, default=FRAMES)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='headless runs per scenario, the best is kept')
+    parser.add_argument('--no-render', action='store_true',
+                        help='skip the rendered frames/sec timing')
+    parser.add_argument('--dirty', action='store_true',
+                        help='time the dirty rect renderer')
+    parser.add_argument('--video-driver',
+                        help='SDL video driver, e.g. "dummy" on machines '
+                             'without a display')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write the results to PATH as JSON')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare against the results stored in PATH')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed regression as a fraction, default '
+                             '%(default)s')
+    args = parser.parse_args()
+    if args.save_baseline and not args.baseline:
+        parser.error('--save-baseline needs --baseline')
+
+    renderer = None
+    if not args.no_render:
+        renderer = make_renderer(args.video_driver, args.dirty)
+    results = benchmark(args.scenario or list(SCENARIOS), args.frames,
+                        args.repeat, renderer)
+    for name, result in results.items():
+        print('{:<12} {}'.format(name, '  '.join(
+            '{} {}'.format(metric, value)
+            for metric, value in result.items())))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        if args.save_baseline or not os.path.exists(args.baseline):
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+            print('baseline saved to {}'.format(args.baseline))
+        else:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            found = regressions(results, baseline, args.threshold)
+            for line in found:
+                print('REGRESSION ' + line)
+            if found:
+                sys.exit(1)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# Policy evaluation
+# Plays every policy on every seed of a range, headless and to the end of the
+# game, on a pool of worker processes. Each game's result is stored in a
+# SQLite database in batched transactions keyed by policy and seed, so an
+# interrupted run started again only plays the games that are missing.
+# Policies are compared on the seeds they have in common, with confidence
+# intervals for the means and for each policy's difference to the best.
+#
+# A policy is one of:
+#   idle, sweep, track_mystery,   the built-in scripted bots
+#   autopilot
+#   module:name                   a callable policy(game, frame) -> action,
+#                                 or a class instantiated once per game
+#   replay:PATH                   the inputs of a recorded replay, played
+#                                 open loop on each seed
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from statistics import NormalDist, mean, stdev
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from autopilot import Autopilot
+from bench_suite import sweep, track_mystery
+from spaceinvaders import ACTION_NONE, FPS, SpaceInvaders
+
+SEEDS = 1000
+BATCH_SIZE = 100
+CONFIDENCE = 0.95
+MAX_FRAMES = FPS * 60 * 60  # An hour of play
+STARTING_LIVES = 3
+METRICS = ('score', 'rounds', 'lives_lost', 'frames')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    policy TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    rounds INTEGER NOT NULL,
+    lives_lost INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    finished INTEGER NOT NULL,
+    PRIMARY KEY (policy, seed)
+)'''
+
+
+def idle(game, frame):
+    return ACTION_NONE
+
+
+BOTS = {'idle': idle, 'sweep': sweep, 'track_mystery': track_mystery,
+        'autopilot': Autopilot}
+# Spec -> policy factory, per worker process
+FACTORIES = {}
+
+
+class ReplayPolicy(object):
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def __call__(self, game, frame):
+        if frame < len(self.inputs):
+            return self.inputs[frame]
+        return ACTION_NONE
+
+
+def load_factory(spec):
+    # Returns a function making the policy for one game
+    if spec in BOTS:
+        bot = BOTS[spec]
+        if isinstance(bot, type):
+            return bot
+        return lambda: bot
+    if spec.startswith('replay:'):
+        from replay import ACTION_MASK, Replay
+        inputs = bytes(value & ACTION_MASK
+                       for value in Replay.load(spec[len('replay:'):]).inputs)
+        return lambda: ReplayPolicy(inputs)
+    module, _, name = spec.partition(':')
+    if not name:
+        raise ValueError('unknown policy {!r}'.format(spec))
+    policy = getattr(importlib.import_module(module), name)
+    if isinstance(policy, type):
+        return policy
+    return lambda: policy
+
+
+def make_policy(spec):
+    if spec not in FACTORIES:
+        FACTORIES[spec] = load_factory(spec)
+    return FACTORIES[spec]()
+
+
+def play(task):
+    spec, seed, maxFrames = task
+    policy = make_policy(spec)
+    start = time.perf_counter()
+    game = SpaceInvaders(seed=seed)
+    frame = 0
+    done = False
+    while not done and frame < maxFrames:
+        reward, done = game.step(policy(game, frame))
+        frame += 1
+    return (spec, seed, game.score, game.round, STARTING_LIVES - game.lives,
+            frame, time.perf_counter() - start, done)
+
+
+class ResultStore(object):
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(SCHEMA)
+        self.pending = []
+
+    def played(self, policies):
+        marks = ','.join('?' * len(policies))
+        return set(self.db.execute(
+            'SELECT policy, seed FROM games WHERE policy IN ({})'.format(
+                marks), policies))
+
+    def add(self, result, batch=BATCH_SIZE):
+        self.pending.append(result)
+        if len(self.pending) >= batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO games VALUES '
+                                '(?, ?, ?, ?, ?, ?, ?, ?)', self.pending)
+        self.pending = []
+
+    def results(self, policies, seeds):
+        # policy -> seed -> row, for the seeds in the range only
+        found = OrderedDict((policy, {}) for policy in policies)
+        for row in self.db.execute(
+                'SELECT policy, seed, {}, seconds, finished FROM games '
+                'WHERE seed >= ? AND seed < ?'.format(', '.join(METRICS)),
+                (seeds.start, seeds.stop)):
+            if row[0] in found:
+                found[row[0]][row[1]] = row[2:]
+        return found
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def evaluate(store, policies, seeds, workers=None, maxFrames=MAX_FRAMES,
+             batch=BATCH_SIZE, progress=None):
+    played = store.played(policies)
+    tasks = [(policy, seed, maxFrames) for policy in policies
+             for seed in seeds if (policy, seed) not in played]
+    if not tasks:
+        return 0
+    workers = workers or multiprocessing.cpu_count()
+    chunk = max(1, min(16, len(tasks) // (workers * 4)))
+    pool = multiprocessing.Pool(workers)
+    try:
+        for count, result in enumerate(
+                pool.imap_unordered(play, tasks, chunk), 1):
+            store.add(result, batch)
+            if progress is not None:
+                progress(count, len(tasks))
+        pool.close()
+    finally:
+        # Whatever finished is kept, also when interrupted
+        pool.terminate()
+        pool.join()
+        store.flush()
+    return len(tasks)
+
+
+def interval(values, confidence=CONFIDENCE):
+    # Mean and the half width of its normal confidence interval
+    if len(values) < 2:
+        return mean(values), float('nan')
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return mean(values), z * stdev(values) / len(values) ** 0.5
+
+
+def summarize(results, confidence=CONFIDENCE):
+    # Only the seeds every policy has played, so the comparison is paired
+    seeds = None
+    for games in results.values():
+        seeds = set(games) if seeds is None else seeds & set(games)
+    seeds = sorted(seeds or ())
+    rows = []
+    for policy, games in results.items():
+        row = OrderedDict([('policy', policy), ('games', len(seeds))])
+        if seeds:
+            for i, metric in enumerate(METRICS):
+                row[metric] = interval([games[seed][i] for seed in seeds],
+                                       confidence)
+            row['finished'] = mean(games[seed][-1] for seed in seeds)
+            row['seconds'] = sum(games[seed][-2] for seed in seeds)
+        rows.append(row)
+    if not seeds:
+        return rows
+    rows.sort(key=lambda row: -row['score'][0])
+    best = results[rows[0]['policy']]
+    for row in rows:
+        games = results[row['policy']]
+        row['vs_best'] = interval([games[seed][0] - best[seed][0]
+                                   for seed in seeds], confidence)
+    return rows
+
+
+def report_lines(rows, confidence=CONFIDENCE):
+    if not rows or not rows[0]['games']:
+        return ['no games played on common seeds']
+    lines = ['{} games per policy, {:.0%} confidence intervals'.format(
+        rows[0]['games'], confidence)]
+    for row in rows:
+        lines.append('{:<24} {}  vs best {:+.1f} +/- {:.1f}  finished '
+                     '{:.0%}  {:.1f} s'.format(
+                         row['policy'],
+                         '  '.join('{} {:.1f} +/- {:.1f}'.format(
+                             metric, *row[metric]) for metric in METRICS),
+                         row['vs_best'][0], row['vs_best'][1],
+                         row['finished'], row['seconds']))
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate Space Invaders '
+                                                 'policies across seeds')
+    parser.add_argument('policies', nargs='+', metavar='POLICY',
+                        help='idle, sweep, track_mystery, autopilot, '
+                             'module:name or replay:PATH')
+    parser.add_argument('--db', default='evaluation.db', metavar='PATH',
+                        help='results database, created if missing and '
+                             'resumed otherwise')
+    parser.add_argument('--seeds', type=int, default=SEEDS,
+                        help='games per policy')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int,
+                        help='processes, one per CPU by default')
+    parser.add_argument('--max-frames', type=int, default=MAX_FRAMES,
+                        help='stop games still running after this many '
+                             'frames')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE,
+                        help='results per database transaction')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    parser.add_argument('--report-only', action='store_true',
+                        help='only summarize what is already stored')
+    args = parser.parse_args()
+    if not 0 < args.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+
+    for spec in args.policies:
+        try:
+            load_factory(spec)
+        except (ImportError, AttributeError, OSError, ValueError) as e:
+            parser.error('policy {}: {}'.format(spec, e))
+
+    def progress(count, total):
+        if count % 100 == 0 or count == total:
+            sys.stderr.write('\r{}/{} games'.format(count, total))
+            if count == total:
+                sys.stderr.write('\n')
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    store = ResultStore(args.db)
+    try:
+        if not args.report_only:
+            start = time.perf_counter()
+            count = evaluate(store, args.policies, seeds, args.workers,
+                             args.max_frames, args.batch, progress)
+            print('played {} games in {:.1f} s'.format(
+                count, time.perf_counter() - start))
+        rows = summarize(store.results(args.policies, seeds),
+                         args.confidence)
+        for line in report_lines(rows, args.confidence):
+            print(line)
+    except KeyboardInterrupt:
+        print('\ninterrupted; run again to resume')
+        sys.exit(1)
+    finally:
+        store.close()
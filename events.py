@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# Gameplay events
+# The game emits small typed records into a preallocated ring buffer; a
+# background thread drains it and appends whole chunks to a file. Emitting
+# is a struct pack into the buffer, so the game never waits on I/O; when the
+# writer falls behind and the buffer is full, new events are dropped and
+# counted instead. One stream serves one game, the only thread emitting.
+#
+# A path ending in .jsonl gets one JSON object per event, anything else the
+# compact binary form: a header, then fixed size records of
+#   frame u32, kind u8, a i16, b i16, c i32
+# whose fields mean what FIELDS says for the kind.
+
+import json
+import struct
+import sys
+import threading
+
+EVENTS_MAGIC = b'SIEV'
+EVENTS_VERSION = 1
+HEADER = struct.Struct('<4sBB')
+RECORD = struct.Struct('<IBhhi')
+CAPACITY = 1 << 16  # Records
+FLUSH_INTERVAL = 0.25  # Seconds
+
+SHOT_FIRED = 1
+ENEMY_SHOT = 2
+ENEMY_KILLED = 3
+MYSTERY_HIT = 4
+SHIP_DESTROYED = 5
+SHIELD_CELL_DESTROYED = 6
+ROUND_CLEARED = 7
+
+# Kind -> (name, names of the a, b and c fields); None fields are unused
+FIELDS = {
+    SHOT_FIRED: ('shot_fired', ('x', 'y', 'bullets')),
+    ENEMY_SHOT: ('enemy_shot', ('row', 'column', None)),
+    ENEMY_KILLED: ('enemy_killed', ('row', 'column', 'score')),
+    MYSTERY_HIT: ('mystery_hit', ('x', None, 'score')),
+    SHIP_DESTROYED: ('ship_destroyed', ('x', None, 'lives')),
+    SHIELD_CELL_DESTROYED: ('shield_cell_destroyed', ('x', 'y', 'size')),
+    ROUND_CLEARED: ('round_cleared', ('round', None, 'score')),
+}
+
+
+class NullEvents(object):
+    def emit(self, kind, frame, a=0, b=0, c=0):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_EVENTS = NullEvents()
+
+
+def event_dict(frame, kind, a, b, c):
+    name, fields = FIELDS[kind]
+    event = {'frame': frame, 'event': name}
+    for field, value in zip(fields, (a, b, c)):
+        if field is not None:
+            event[field] = value
+    return event
+
+
+class EventStream(object):
+    def __init__(self, path, capacity=CAPACITY, interval=FLUSH_INTERVAL):
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.view = memoryview(self.buffer)
+        # Records ever emitted and ever drained; only the game moves head and
+        # only the writer moves tail
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.jsonLines = path.endswith('.jsonl')
+        if self.jsonLines:
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'ab')
+            if self.file.tell() == 0:
+                self.file.write(HEADER.pack(EVENTS_MAGIC, EVENTS_VERSION,
+                                            RECORD.size))
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='events',
+                                       daemon=True)
+        self.thread.start()
+
+    def emit(self, kind, frame, a=0, b=0, c=0):
+        head = self.head
+        pending = head - self.tail
+        if pending >= self.capacity:
+            self.dropped += 1
+            return
+        RECORD.pack_into(self.buffer, (head % self.capacity) * RECORD.size,
+                         frame, kind, a, b, c)
+        self.head = head + 1
+        if pending == self.capacity // 2:
+            # Half full; don't wait for the writer's next round
+            self.wake.set()
+
+    def drain(self):
+        # The records emitted since the last drain, as one bytes object
+        head = self.head
+        tail = self.tail
+        if head == tail:
+            return b''
+        start = (tail % self.capacity) * RECORD.size
+        end = (head % self.capacity) * RECORD.size
+        if start < end:
+            data = bytes(self.view[start:end])
+        else:
+            data = bytes(self.view[start:]) + bytes(self.view[:end])
+        self.tail = head
+        return data
+
+    def write(self, data):
+        if not data:
+            return
+        if self.jsonLines:
+            self.file.write(''.join(
+                json.dumps(event_dict(*record)) + '\n'
+                for record in RECORD.iter_unpack(data)))
+        else:
+            self.file.write(data)
+        self.file.flush()
+
+    def run(self):
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.write(self.drain())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        self.write(self.drain())
+        self.file.close()
+
+
+def read_events(path):
+    # Yields (frame, kind, a, b, c) from a binary event file
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, size = HEADER.unpack_from(data)
+    if magic != EVENTS_MAGIC or version != EVENTS_VERSION or \
+            size != RECORD.size:
+        raise ValueError('{} is not a version {} event file'.format(
+            path, EVENTS_VERSION))
+    body = len(data) - HEADER.size
+    for record in RECORD.iter_unpack(
+            data[HEADER.size:HEADER.size + body - body % RECORD.size]):
+        yield record
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Print a binary event '
+                                                 'file as JSON lines')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    for record in read_events(args.path):
+        sys.stdout.write(json.dumps(event_dict(*record)) + '\n')
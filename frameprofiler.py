@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Frame profiler
+# Times the phases of each frame with a monotonic clock and keeps a rolling
+# window of samples per phase, so percentiles reflect recent frames only.
+# Nothing here is referenced by the game until a profiler is attached, so a
+# game that is not being profiled runs exactly the same code as before.
+
+import csv
+import json
+from collections import OrderedDict, deque
+from time import perf_counter
+
+PROFILER_WINDOW = 600  # Frames, 10 seconds at 60 fps
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered, pct):
+    # Nearest-rank percentile of an already sorted sequence
+    if not ordered:
+        return 0.0
+    index = max(0, -(-len(ordered) * pct // 100) - 1)
+    return ordered[index]
+
+
+class FrameProfiler(object):
+    def __init__(self, window=PROFILER_WINDOW, stream=None, fmt='json'):
+        self.window = window
+        self.samples = OrderedDict()
+        self.current = {}
+        self.counts = OrderedDict()
+        self.frame = 0
+        # Each finished frame is written to the stream as one JSON object
+        # per line, or as one CSV row
+        self.stream = stream
+        self.fmt = fmt
+        self.writer = None
+
+    def register(self, name):
+        # Known phases get a column in every record, also in frames where
+        # they never ran
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.window)
+
+    def wrap(self, name, func):
+        self.register(name)
+        current = self.current
+        clock = perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current[name] = current.get(name, 0.0) + clock() - start
+        return timed
+
+    def instrument(self, obj, attrs, prefix=''):
+        # Shadows bound methods with timed wrappers on the instance itself;
+        # uninstrument() removes them again and the class methods show through
+        for attr in attrs:
+            setattr(obj, attr, self.wrap(prefix + attr, getattr(obj, attr)))
+
+    @staticmethod
+    def uninstrument(obj, attrs):
+        for attr in attrs:
+            obj.__dict__.pop(attr, None)
+
+    def end_frame(self, counts=None):
+        for name, seconds in self.current.items():
+            self.register(name)
+            self.samples[name].append(seconds)
+        if counts:
+            self.counts.update(counts)
+        if self.stream is not None:
+            self.write(self.record(counts))
+        self.current.clear()
+        self.frame += 1
+
+    def discard_frame(self):
+        # Drops timings of a frame that should not be counted, e.g. a menu
+        self.current.clear()
+
+    def record(self, counts=None):
+        record = OrderedDict([('frame', self.frame)])
+        for name in self.samples:
+            record[name + '_ms'] = round(self.current.get(name, 0.0) * 1000, 4)
+        if counts:
+            record.update(counts)
+        return record
+
+    def write(self, record):
+        if self.fmt == 'csv':
+            if self.writer is None:
+                # The columns are fixed by the first frame written
+                self.writer = csv.DictWriter(self.stream, list(record),
+                                             restval='', extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(record)
+        else:
+            self.stream.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        # Milliseconds per phase over the rolling window
+        summary = OrderedDict()
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            stats = OrderedDict(('p{}'.format(pct),
+                                 percentile(ordered, pct) * 1000)
+                                for pct in PERCENTILES)
+            stats['max'] = ordered[-1] * 1000 if ordered else 0.0
+            summary[name] = stats
+        return summary
+
+    def report_rows(self):
+        rows = [['ms', 'p50', 'p95', 'p99', 'max']]
+        for name, stats in self.summary().items():
+            rows.append([name] + ['{:.2f}'.format(stats[key])
+                                  for key in ('p50', 'p95', 'p99', 'max')])
+        for name, count in self.counts.items():
+            rows.append([name, str(count)])
+        return rows
+
+    def report_lines(self):
+        return [''.join(['{:<18}'.format(row[0])] +
+                        ['{:>8}'.format(cell) for cell in row[1:]])
+                for row in self.report_rows()]
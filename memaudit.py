@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Memory audit
+# Measures with tracemalloc what the game's objects cost: the bytes per
+# instance of each entity type, built in bulk so allocator noise averages
+# out, and the bytes per SpaceInvaders instance with many games alive at
+# once, fresh and after some frames of play. Images, fonts and wave tables
+# are shared by every game, so they are loaded before tracing starts and are
+# not charged to anyone.
+
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from bench_suite import sweep
+from spaceinvaders import (BLOCKERS_POSITION, GREEN, Bullet, Enemy,
+                           EnemiesGroup, EnemyExplosion, Life, Mystery,
+                           MysteryExplosion, Shield, Ship, ShipExplosion,
+                           SpaceInvaders)
+from waves import load_waves
+
+ENTITIES = 1000
+GAMES = 100
+FRAMES = 600
+
+
+def entity_factories(waves):
+    explosion = waves.explosions[0]
+    wave = waves.wave(0)
+    return [
+        ('Enemy', lambda i: Enemy(i % wave.rows, i % wave.columns)),
+        ('Bullet', lambda i: Bullet(i, 100, 1, 5, 'enemylaser', 'center')),
+        ('EnemyExplosion', lambda i: EnemyExplosion(explosion, i, 100, 0)),
+        ('MysteryExplosion', lambda i: MysteryExplosion(150, i, 100, 0)),
+        ('ShipExplosion', lambda i: ShipExplosion(i, 540, 0)),
+        ('Shield', lambda i: Shield(i, BLOCKERS_POSITION, GREEN)),
+        ('Ship', lambda i: Ship()),
+        ('Mystery', lambda i: Mystery(0)),
+        ('Life', lambda i: Life(i, 3)),
+        ('EnemiesGroup (full)', lambda i: full_formation(wave, waves)),
+    ]
+
+
+def full_formation(wave, waves):
+    enemies = EnemiesGroup(wave, waves.start, 0)
+    enemies.populate()
+    return enemies
+
+
+def traced(make, count):
+    # Bytes still allocated per object after making count of them
+    objects = [None] * count
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        objects[i] = make(i)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    return size / float(count), objects
+
+
+def play(games, frames):
+    for game in games:
+        for frame in range(frames):
+            reward, done = game.step(sweep(game, frame))
+            if done:
+                break
+
+
+def audit(entities=ENTITIES, games=GAMES, frames=FRAMES, top=0):
+    waves = load_waves()
+    factories = entity_factories(waves)
+    # Everything shared gets loaded and cached before anything is counted
+    play([SpaceInvaders(seed=0)], frames)
+    for name, make in factories:
+        make(0)
+
+    tracemalloc.start()
+    results = {'entities': {}, 'games': {}}
+    try:
+        for name, make in factories:
+            count = entities if not name.startswith('EnemiesGroup') else 10
+            results['entities'][name] = traced(make, count)[0]
+        gc.collect()
+        start = tracemalloc.take_snapshot()
+        size, instances = traced(lambda seed: SpaceInvaders(seed=seed),
+                                 games)
+        results['games']['fresh'] = size
+        before = tracemalloc.get_traced_memory()[0]
+        play(instances, frames)
+        gc.collect()
+        results['games']['after {} frames'.format(frames)] = \
+            size + (tracemalloc.get_traced_memory()[0] - before) / \
+            float(games)
+        if top:
+            stats = tracemalloc.take_snapshot().compare_to(start, 'lineno')
+            results['top'] = [(str(stat.traceback),
+                               stat.size_diff / float(games))
+                              for stat in stats[:top]]
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Space Invaders memory '
+                                                 'audit')
+    parser.add_argument('--entities', type=int, default=ENTITIES,
+                        help='instances made of each entity type')
+    parser.add_argument('--games', type=int, default=GAMES,
+                        help='games alive at once')
+    parser.add_argument('--frames', type=int, default=FRAMES,
+                        help='frames each game is played before the second '
+                             'measurement')
+    parser.add_argument('--top', type=int, default=0, metavar='N',
+                        help='also list the N source lines holding the most '
+                             'memory per game')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    if args.entities < 1 or args.games < 1:
+        parser.error('--entities and --games must be positive')
+    if args.frames < 0:
+        parser.error('--frames must not be negative')
+
+    results = audit(args.entities, args.games, args.frames, args.top)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print('bytes per entity')
+        for name, size in sorted(results['entities'].items(),
+                                 key=lambda item: -item[1]):
+            print('  {:<24} {:10.0f}'.format(name, size))
+        print('bytes per game')
+        for name, size in results['games'].items():
+            print('  {:<24} {:10.0f}'.format(name, size))
+        if results.get('top'):
+            print('largest allocation sites per game')
+            for site, size in results['top']:
+                print('  {:10.0f}  {}'.format(size, site))
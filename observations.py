@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Observations
+# Encoders that turn a game into arrays for agents without copying more than
+# they have to. PixelEncoder reads a rendered surface through a surfarray
+# view and writes a downsampled, optionally grayscale frame into a ring
+# buffer of stacked frames. SymbolicEncoder writes the game state itself into
+# one reusable float32 vector. Both return views of their own buffers, which
+# the next encode() overwrites.
+
+import numpy as np
+from collections import OrderedDict
+from pygame import surfarray
+
+# ITU-R 601 luma weights in 1/256ths; they add up to 256 so the result of the
+# shift always fits a byte
+GRAY_WEIGHTS = (77, 150, 29)
+MAX_PLAYER_BULLETS = 2
+MAX_ENEMY_BULLETS = 8
+# Widest row that is unpacked through a lookup table rather than bit by bit
+MAX_TABLE_COLUMNS = 16
+SCREEN_WIDTH = 800.0
+SCREEN_HEIGHT = 600.0
+BIT_TABLES = {}
+
+
+class PixelEncoder(object):
+    def __init__(self, surface, stack=4, downsample=1, grayscale=True):
+        self.surface = surface
+        self.stack = stack
+        self.downsample = downsample
+        self.grayscale = grayscale
+        width, height = surface.get_size()
+        shape = ((height + downsample - 1) // downsample,
+                 (width + downsample - 1) // downsample)
+        if not grayscale:
+            shape += (3,)
+        # Every frame is written twice, stack frames apart, so the latest
+        # stack frames are always one contiguous slice in time order
+        self.frames = np.zeros((stack * 2,) + shape, np.uint8)
+        self.index = 0
+        if grayscale:
+            self.work = np.empty(shape, np.uint16)
+            self.channel = np.empty(shape, np.uint16)
+
+    def reset(self):
+        self.frames.fill(0)
+        self.index = 0
+
+    def encode(self):
+        # The surface is locked while a pixel view exists, so the view is
+        # only held for the duration of the copy
+        view = surfarray.pixels3d(self.surface)
+        step = self.downsample
+        pixels = view[::step, ::step].transpose(1, 0, 2)
+        frame = self.frames[self.index]
+        if self.grayscale:
+            work = self.work
+            channel = self.channel
+            np.multiply(pixels[..., 0], GRAY_WEIGHTS[0], out=work,
+                        dtype=np.uint16)
+            for i in (1, 2):
+                np.multiply(pixels[..., i], GRAY_WEIGHTS[i], out=channel,
+                            dtype=np.uint16)
+                work += channel
+            np.right_shift(work, 8, out=frame, casting='unsafe')
+        else:
+            frame[...] = pixels
+        del pixels, view
+        self.frames[self.index + self.stack] = frame
+        self.index = (self.index + 1) % self.stack
+        return self.observation()
+
+    def observation(self):
+        # Oldest frame first
+        return self.frames[self.index:self.index + self.stack]
+
+
+class SymbolicEncoder(object):
+    # Layout, all scaled to about [0, 1]:
+    #   enemies     one flag per formation cell, row major
+    #   formation   x, y, animation frame, direction
+    #   ship        x, alive, lives
+    #   mystery     x, alive
+    #   bullets     x, y, present for each slot, player then enemy bullets
+    #   shields     one flag per shield cell, shield then row major
+    # vector, when given, is written in place instead of a buffer of its own,
+    # e.g. a row of a shared array
+    def __init__(self, game, vector=None):
+        enemies = game.enemies
+        self.rows = enemies.rows
+        self.columns = enemies.columns
+        shields = game.allBlockers.sprites()
+        self.shieldRows = shields[0].rows
+        self.shieldColumns = shields[0].columns
+        sizes = OrderedDict([
+            ('enemies', self.rows * self.columns),
+            ('formation', 4),
+            ('ship', 3),
+            ('mystery', 2),
+            ('bullets', 3 * (MAX_PLAYER_BULLETS + MAX_ENEMY_BULLETS)),
+            ('shields', len(shields) * self.shieldRows * self.shieldColumns)])
+        self.layout = OrderedDict()
+        start = 0
+        for name, size in sizes.items():
+            self.layout[name] = slice(start, start + size)
+            start += size
+        self.size = start
+        if vector is None:
+            vector = np.zeros(self.size, np.float32)
+        elif vector.shape != (self.size,) or vector.dtype != np.float32:
+            raise ValueError('vector must be float32 of shape ({},)'.format(
+                self.size))
+        self.vector = vector
+        # Row bitmask -> flags, looked up instead of unpacking bit by bit
+        self.enemyBits = None
+        if self.columns <= MAX_TABLE_COLUMNS:
+            self.enemyBits = self.bit_table(self.columns)
+        self.shieldBits = None
+        if self.shieldColumns <= MAX_TABLE_COLUMNS:
+            self.shieldBits = self.bit_table(self.shieldColumns)
+        self.enemyRows = [self.vector[self.layout['enemies']][
+            row * self.columns:(row + 1) * self.columns]
+            for row in range(self.rows)]
+        shieldStart = self.layout['shields'].start
+        self.shieldRowViews = [
+            [self.vector[shieldStart + (i * self.shieldRows + row) *
+                         self.shieldColumns:
+                         shieldStart + (i * self.shieldRows + row + 1) *
+                         self.shieldColumns]
+             for row in range(self.shieldRows)]
+            for i in range(len(shields))]
+        self.bullets = self.vector[self.layout['bullets']].reshape(-1, 3)
+
+    @staticmethod
+    def bit_table(columns):
+        if columns not in BIT_TABLES:
+            masks = np.arange(1 << columns)[:, None]
+            BIT_TABLES[columns] = ((masks >> np.arange(columns)) &
+                                   1).astype(np.float32)
+        return BIT_TABLES[columns]
+
+    def encode(self, game):
+        vector = self.vector
+        enemies = game.enemies
+        enemyBits = self.enemyBits
+        for view, mask in zip(self.enemyRows, enemies.aliveMasks):
+            if enemyBits is not None:
+                view[:] = enemyBits[mask]
+            else:
+                self.unpack(view, mask)
+
+        start = self.layout['formation'].start
+        vector[start] = (enemies.x + enemies.offsetX) / SCREEN_WIDTH
+        vector[start + 1] = (enemies.y + enemies.offsetY) / SCREEN_HEIGHT
+        vector[start + 2] = enemies.frame
+        vector[start + 3] = enemies.direction
+
+        start = self.layout['ship'].start
+        vector[start] = game.player.rect.x / SCREEN_WIDTH
+        vector[start + 1] = game.shipAlive
+        vector[start + 2] = game.lives / 3.0
+
+        start = self.layout['mystery'].start
+        vector[start] = game.mysteryShip.rect.x / SCREEN_WIDTH
+        vector[start + 1] = game.mysteryShip.alive()
+
+        bullets = self.bullets
+        bullets.fill(0)
+        self.fill_bullets(bullets, 0, MAX_PLAYER_BULLETS, game.bullets)
+        self.fill_bullets(bullets, MAX_PLAYER_BULLETS, MAX_ENEMY_BULLETS,
+                          game.enemyBullets)
+
+        shieldBits = self.shieldBits
+        for views, shield in zip(self.shieldRowViews, game.allBlockers):
+            for view, cells in zip(views, shield.cells):
+                if shieldBits is not None:
+                    view[:] = shieldBits[cells]
+                else:
+                    self.unpack(view, cells)
+        return vector
+
+    @staticmethod
+    def unpack(view, mask):
+        # Rows too wide for a table are unpacked a byte at a time
+        columns = len(view)
+        bits = np.unpackbits(np.frombuffer(
+            mask.to_bytes((columns + 7) // 8, 'little'), np.uint8),
+            bitorder='little')
+        view[:] = bits[:columns]
+
+    @staticmethod
+    def fill_bullets(bullets, start, count, group):
+        # The oldest bullets when there are more than there are slots
+        slot = start
+        for bullet in group:
+            if slot == start + count:
+                break
+            bullets[slot, 0] = bullet.rect.x / SCREEN_WIDTH
+            bullets[slot, 1] = bullet.rect.y / SCREEN_HEIGHT
+            bullets[slot, 2] = 1
+            slot += 1
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Replays
+# A replay is the seed of a session plus one byte of input per frame, so a
+# game can be reproduced exactly by stepping a fresh SpaceInvaders with the
+# recorded actions. Periodic checkpoints of the full game state let a viewer
+# jump to any frame by simulating from the nearest one instead of frame 0.
+#
+# File layout, little endian:
+#   header      magic, version, fps, seed, frame count, checkpoint count
+#   inputs      u32 length, zlib compressed action bytes
+#   checkpoints per checkpoint: u32 frame, u32 length, game snapshot
+
+import argparse
+import struct
+import sys
+import time
+import zlib
+from bisect import bisect_right
+
+from spaceinvaders import FPS, TickClock, SpaceInvaders
+
+REPLAY_MAGIC = b'SIRP'
+REPLAY_VERSION = 4
+CHECKPOINT_INTERVAL = 600  # Frames
+# Set on a frame's input byte when a new game starts before that step
+NEW_GAME = 0x80
+ACTION_MASK = 0x7f
+
+HEADER = struct.Struct('<4sBHQII')
+MAX_SEED = 1 << 64  # Seeds are stored as u64
+BLOCK = struct.Struct('<I')
+CHECKPOINT = struct.Struct('<II')
+
+
+class Replay(object):
+    def __init__(self, seed, inputs=None, checkpoints=None, fps=FPS):
+        self.seed = seed
+        self.fps = fps
+        self.inputs = bytearray(inputs or b'')
+        # Frame numbers and the snapshot taken before that frame's input
+        self.checkpointFrames = []
+        self.checkpoints = []
+        for frame, data in checkpoints or ():
+            self.add_checkpoint(frame, data)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def add_checkpoint(self, frame, data):
+        index = bisect_right(self.checkpointFrames, frame)
+        self.checkpointFrames.insert(index, frame)
+        self.checkpoints.insert(index, data)
+
+    def new_game(self):
+        return SpaceInvaders(TickClock(self.fps), self.seed)
+
+    def apply(self, game, frame):
+        value = self.inputs[frame]
+        if value & NEW_GAME:
+            game.new_game()
+        return game.step(value & ACTION_MASK)
+
+    def play(self, game=None, start=0, stop=None):
+        # Steps game through frames [start, stop) as fast as possible
+        if game is None:
+            game = self.new_game()
+        stop = len(self.inputs) if stop is None else stop
+        for frame in range(start, stop):
+            self.apply(game, frame)
+        return game
+
+    def seek(self, frame):
+        # The game as it was before the input of the given frame
+        if not 0 <= frame <= len(self.inputs):
+            raise IndexError('frame {} is outside the replay'.format(frame))
+        game = self.new_game()
+        start = 0
+        index = bisect_right(self.checkpointFrames, frame) - 1
+        if index >= 0:
+            start = self.checkpointFrames[index]
+            game.restore(self.checkpoints[index])
+        return self.play(game, start, frame)
+
+    def verify(self):
+        # Plays the replay from the start and returns the first checkpoint
+        # frame whose state differs, or None if every checkpoint matches
+        game = self.new_game()
+        frame = 0
+        for checkpoint, data in zip(self.checkpointFrames, self.checkpoints):
+            self.play(game, frame, checkpoint)
+            frame = checkpoint
+            if game.snapshot() != data:
+                return checkpoint
+        return None
+
+    def save(self, path):
+        inputs = zlib.compress(bytes(self.inputs))
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.fps,
+                                self.seed, len(self.inputs),
+                                len(self.checkpoints)))
+            f.write(BLOCK.pack(len(inputs)))
+            f.write(inputs)
+            for frame, data in zip(self.checkpointFrames, self.checkpoints):
+                f.write(CHECKPOINT.pack(frame, len(data)))
+                f.write(data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, fps, seed, frames, count = HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError('{} is not a version {} replay'.format(
+                path, REPLAY_VERSION))
+        offset = HEADER.size
+        length, = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        inputs = zlib.decompress(data[offset:offset + length])
+        offset += length
+        if len(inputs) != frames:
+            raise ValueError('{} is truncated'.format(path))
+        checkpoints = []
+        for _ in range(count):
+            frame, length = CHECKPOINT.unpack_from(data, offset)
+            offset += CHECKPOINT.size
+            checkpoints.append((frame, data[offset:offset + length]))
+            offset += length
+        return cls(seed, inputs, checkpoints, fps)
+
+
+class Recorder(object):
+    # Stands in for the game's step() and new_game() while recording. The
+    # game must be fresh from SpaceInvaders(seed=...) with an integer seed
+    # that fits the header.
+    def __init__(self, game, interval=CHECKPOINT_INTERVAL):
+        if game.seed is None or game.clock.frame:
+            raise ValueError('recording needs a freshly seeded game')
+        if not 0 <= game.seed < MAX_SEED:
+            raise ValueError('recorded seeds must be in [0, 2**64)')
+        self.game = game
+        self.interval = interval
+        self.replay = Replay(game.seed, fps=game.clock.fps)
+        self.newGame = 0
+
+    def new_game(self):
+        self.game.new_game()
+        self.newGame = NEW_GAME
+
+    def step(self, action):
+        frame = len(self.replay.inputs)
+        if frame % self.interval == 0:
+            self.replay.add_checkpoint(frame, self.game.snapshot())
+        self.replay.inputs.append(action & ACTION_MASK | self.newGame)
+        self.newGame = 0
+        return self.game.step(action)
+
+    def save(self, path):
+        self.replay.save(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Space Invaders replays')
+    parser.add_argument('path')
+    parser.add_argument('--seek', type=int, metavar='FRAME',
+                        help='show the game at FRAME using the checkpoints')
+    parser.add_argument('--verify', action='store_true',
+                        help='check that playback reproduces every '
+                             'checkpoint')
+    args = parser.parse_args()
+
+    replay = Replay.load(args.path)
+    print('seed {}  {} frames  {} checkpoints'.format(
+        replay.seed, len(replay), len(replay.checkpoints)))
+    if args.verify:
+        frame = replay.verify()
+        if frame is not None:
+            print('desync at frame {}'.format(frame))
+            sys.exit(1)
+        print('all checkpoints match')
+    start = time.perf_counter()
+    if args.seek is not None:
+        game = replay.seek(args.seek)
+    else:
+        game = replay.play()
+    elapsed = time.perf_counter() - start
+    print('frame {}  score {}  lives {}  game over {}  ({:.1f} ms)'.format(
+        game.clock.frame, game.score, game.lives, game.gameOver,
+        elapsed * 1000))
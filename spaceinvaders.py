@@ -4,9 +4,19 @@
 # Created by Lee Robinson
 
 from pygame import *
+import struct
 import sys
+from abc import ABCMeta, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
 from os.path import abspath, dirname
-from random import choice
+from random import Random
+
+from audio import NULL_AUDIO, NOTE_COUNT, MixerAudio
+from events import (ENEMY_KILLED, ENEMY_SHOT, MYSTERY_HIT, NULL_EVENTS,
+                    ROUND_CLEARED, SHIELD_CELL_DESTROYED, SHIP_DESTROYED,
+                    SHOT_FIRED, EventStream)
+from waves import ENEMY_HEIGHT, ENEMY_WIDTH, load_waves
 
 BASE_PATH = abspath(dirname(__file__))
 FONT_PATH = BASE_PATH + '/fonts/'
@@ -20,105 +30,534 @@ BLUE = (80, 255, 239)
 PURPLE = (203, 0, 255)
 RED = (237, 28, 36)
 
-SCREEN = display.set_mode((800, 600))
 FONT = FONT_PATH + 'space_invaders.ttf'
-IMG_NAMES = ['ship', 'mystery',
-             'enemy1_1', 'enemy1_2',
-             'enemy2_1', 'enemy2_2',
-             'enemy3_1', 'enemy3_2',
-             'explosionblue', 'explosiongreen', 'explosionpurple',
-             'laser', 'enemylaser']
-IMAGES = {name: image.load(IMAGE_PATH + '{}.png'.format(name)).convert_alpha()
-          for name in IMG_NAMES}
+
+
+class ImageCache(dict):
+    # Images are loaded on first use, so importing the module stays cheap and
+    # the simulation can run headless; once a window exists they are
+    # converted to the screen format
+    def __missing__(self, name):
+        img = image.load(IMAGE_PATH + '{}.png'.format(name))
+        if display.get_surface() is not None:
+            img = img.convert_alpha()
+        self[name] = img
+        return img
+
+
+IMAGES = ImageCache()
 
 BLOCKERS_POSITION = 450
-ENEMY_DEFAULT_POSITION = 65  # Initial value for a new game
-ENEMY_MOVE_DOWN = 35
+BLOCKER_SIZE = 10
+SHIELD_COLUMNS = 9  # In BLOCKER_SIZE cells
+SHIELD_ROWS = 4
+FPS = 60
+# At most this many steps per drawn frame are run to catch up with real time;
+# past it the game slows down instead of stalling the display
+MAX_CATCH_UP_STEPS = 5
+# Further than anything moves in one step; a sprite that jumped more was
+# reused or respawned and is not interpolated
+MAX_STEP_DISTANCE = 32
+GRID_CELL_SIZE = 40
+# Past this many changed regions the dirty renderer redraws the whole frame
+MAX_DIRTY_RECTS = 64
+TEXT_CACHE_SIZE = 256
+PROFILER_FONT_SIZE = 12
+# SpaceInvaders methods timed by an attached FrameProfiler
+PROFILED_PHASES = ('check_input', 'update_enemies', 'update_sprites',
+                   'update_explosions', 'check_collisions', 'create_new_ship',
+                   'make_enemies_shoot')
+BULLET_POOL_SIZE = 32
+EXPLOSION_POOL_SIZE = 16
+ATLAS_WIDTH = 512
+
+# Every scaled variant the game draws, as (image name, size); None keeps the
+# source size. They are all packed once into a single atlas surface.
+ATLAS_VARIANTS = [('ship', None), ('laser', None), ('enemylaser', None),
+                  ('ship', (23, 23)), ('mystery', (75, 35)),
+                  ('enemy1_1', (40, 35)), ('enemy1_2', (40, 35)),
+                  ('enemy2_1', (40, 35)), ('enemy2_2', (40, 35)),
+                  ('enemy3_1', (40, 35)), ('enemy3_2', (40, 35)),
+                  ('explosionblue', (40, 35)), ('explosionblue', (50, 45)),
+                  ('explosiongreen', (40, 35)), ('explosiongreen', (50, 45)),
+                  ('explosionpurple', (40, 35)),
+                  ('explosionpurple', (50, 45)),
+                  ('enemy3_1', (40, 40)), ('enemy2_2', (40, 40)),
+                  ('enemy1_2', (40, 40)), ('mystery', (80, 40))]
+ATLAS = {}
+
+# Snapshot layout: the header, the random generator's state, the enemies,
+# then each bullet, enemy bullet, explosion and shield
+SNAPSHOT_HEADER = struct.Struct('<IiB?H5iB??h?hbi??BBB')
+RANDOM_STATE = struct.Struct('<625I')
+ENEMIES_STATES = {}
+BULLET_STATE = struct.Struct('<hhbbB')
+BULLET_KINDS = [('laser', 'center'), ('laser', 'left'), ('laser', 'right'),
+                ('enemylaser', 'center')]
+BULLET_KIND_INDEX = dict((kind, i) for i, kind in enumerate(BULLET_KINDS))
+EXPLOSION_STATE = struct.Struct('<Bhhhii')
+
+# Actions are a bitmask of the controls held during a frame
+ACTION_NONE = 0
+ACTION_LEFT = 1
+ACTION_RIGHT = 2
+ACTION_FIRE = 4
+
+
+def convert_images():
+    for name, img in IMAGES.items():
+        IMAGES[name] = img.convert_alpha()
+    # Rebuilt in the display format on next use
+    ATLAS.clear()
+
+
+def scale_image(name, size):
+    img = IMAGES[name]
+    return img if size is None else transform.scale(img, size)
+
+
+def build_atlas():
+    # Shelf packing, tallest images first
+    images = sorted(((key, scale_image(*key)) for key in ATLAS_VARIANTS),
+                    key=lambda item: -item[1].get_height())
+    positions = []
+    x = y = shelf = 0
+    for key, img in images:
+        width, height = img.get_size()
+        if x + width > ATLAS_WIDTH:
+            x, y, shelf = 0, y + shelf, 0
+        positions.append((x, y))
+        x += width
+        shelf = max(shelf, height)
+    sheet = Surface((ATLAS_WIDTH, y + shelf), SRCALPHA, 32)
+    for (key, img), pos in zip(images, positions):
+        # Adding onto the cleared sheet copies RGBA without blending
+        sheet.blit(img, pos, special_flags=BLEND_RGBA_ADD)
+    if display.get_surface() is not None:
+        sheet = sheet.convert_alpha()
+    ATLAS.clear()
+    for (key, img), pos in zip(images, positions):
+        ATLAS[key] = sheet.subsurface(Rect(pos, img.get_size()))
+
+
+def enemies_state(rows, columns):
+    # Alive masks, the formation's counters and the column bottoms; each
+    # row's mask is packed into as many bytes as its columns need
+    key = (rows, columns)
+    if key not in ENEMIES_STATES:
+        ENEMIES_STATES[key] = struct.Struct(
+            '<{}shhiiBhhhbhhhiihhh{}H'.format(rows * mask_bytes(columns),
+                                             columns))
+    return ENEMIES_STATES[key]
+
+
+def mask_bytes(columns):
+    return (columns + 7) // 8
+
+
+def atlas_image(name, size=None):
+    if not ATLAS:
+        build_atlas()
+    key = (name, size)
+    if key not in ATLAS:
+        ATLAS[key] = scale_image(name, size)
+    return ATLAS[key]
+
+
+class TickClock(object):
+    # Fixed timestep clock: every tick advances exactly one 1/fps frame,
+    # independent of how long the frame actually took to compute
+    def __init__(self, fps=FPS):
+        self.fps = fps
+        self.frame = 0
+
+    def tick(self):
+        self.frame += 1
+
+    def get_ticks(self):
+        return self.frame * 1000 // self.fps
+
+
+class SpritePool(object):
+    # Keeps killed sprites around so they can be activated again instead of
+    # allocating new ones. Sprites beyond the capacity are left to the GC.
+    def __init__(self, cls, capacity):
+        self.cls = cls
+        self.capacity = capacity
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.activate(*args)
+            self.hits += 1
+        else:
+            obj = self.cls(*args)
+            obj.pool = self
+            self.misses += 1
+        return obj
+
+    def release(self, obj):
+        if len(self.free) < self.capacity:
+            self.free.append(obj)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'free': len(self.free), 'capacity': self.capacity}
+
+
+# Entities declare __slots__ so the attributes they set live in the
+# instance instead of a dict; pygame's Sprite base still gives each one a
+# dict for its set of groups.
+class PooledSprite(sprite.Sprite):
+    __slots__ = ('pool',)
+
+    def __init__(self):
+        sprite.Sprite.__init__(self)
+        self.pool = None
+
+    def kill(self):
+        if self.alive():
+            sprite.Sprite.kill(self)
+            if self.pool is not None:
+                self.pool.release(self)
 
 
 class Ship(sprite.Sprite):
+    __slots__ = ('image', 'rect', 'speed')
+
     def __init__(self):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['ship']
+        self.image = atlas_image('ship')
         self.rect = self.image.get_rect(topleft=(375, 540))
         self.speed = 5
 
-    def update(self, keys, *args):
-        if keys[K_LEFT] and self.rect.x > 10:
+    def update(self, action, *args):
+        if action & ACTION_LEFT and self.rect.x > 10:
             self.rect.x -= self.speed
-        if keys[K_RIGHT] and self.rect.x < 740:
+        if action & ACTION_RIGHT and self.rect.x < 740:
             self.rect.x += self.speed
-        game.screen.blit(self.image, self.rect)
 
 
-class Bullet(sprite.Sprite):
+class Bullet(PooledSprite):
+    __slots__ = ('image', 'rect', 'speed', 'direction', 'kind')
+
     def __init__(self, xpos, ypos, direction, speed, filename, side):
-        sprite.Sprite.__init__(self)
-        self.image = IMAGES[filename]
-        self.rect = self.image.get_rect(topleft=(xpos, ypos))
+        PooledSprite.__init__(self)
+        self.rect = Rect(0, 0, 0, 0)
+        self.activate(xpos, ypos, direction, speed, filename, side)
+
+    def activate(self, xpos, ypos, direction, speed, filename, side):
+        self.image = atlas_image(filename)
+        self.rect.size = self.image.get_size()
+        self.rect.topleft = (xpos, ypos)
         self.speed = speed
         self.direction = direction
-        self.side = side
-        self.filename = filename
+        # Index into BULLET_KINDS, all a snapshot needs of image and side
+        self.kind = BULLET_KIND_INDEX[(filename, side)]
 
-    def update(self, keys, *args):
-        game.screen.blit(self.image, self.rect)
+    def update(self, *args):
         self.rect.y += self.speed * self.direction
         if self.rect.y < 15 or self.rect.y > 600:
             self.kill()
 
 
+def bullet_state(bullet):
+    return BULLET_STATE.pack(bullet.rect.x, bullet.rect.y, bullet.direction,
+                             bullet.speed, bullet.kind)
+
+
 class Enemy(sprite.Sprite):
+    # Position and animation frame are derived from the formation, so moving
+    # the whole formation never touches individual enemies. An enemy is only
+    # ever in its formation's group, so it keeps that one group in a slot
+    # instead of the set of groups Sprite.__init__ would give it; every
+    # Sprite method using that set is overridden here.
+    __slots__ = ('row', 'column', 'formation', 'group')
+
     def __init__(self, row, column):
-        sprite.Sprite.__init__(self)
         self.row = row
         self.column = column
-        self.images = []
-        self.load_images()
-        self.index = 0
-        self.image = self.images[self.index]
-        self.rect = self.image.get_rect()
+        # Kept after the enemy is killed, so its rect is still known
+        self.formation = None
+        self.group = None
+
+    def __repr__(self):
+        return '<Enemy Sprite(in {} groups)>'.format(len(self.groups()))
+
+    def check_group(self, group):
+        if group is not self.formation:
+            raise ValueError('an enemy can only be in its formation')
+
+    def add(self, *groups):
+        for group in groups:
+            self.check_group(group)
+            if self.group is None:
+                group.add_internal(self)
+                self.add_internal(group)
+
+    def remove(self, *groups):
+        for group in groups:
+            if group is self.group:
+                group.remove_internal(self)
+                self.remove_internal(group)
+
+    def add_internal(self, group):
+        self.check_group(group)
+        self.group = group
+
+    def remove_internal(self, group):
+        self.group = None
+
+    def kill(self):
+        if self.group is not None:
+            self.group.remove_internal(self)
+            self.group = None
+
+    def groups(self):
+        return [] if self.group is None else [self.group]
+
+    def alive(self):
+        return self.group is not None
+
+    @property
+    def rect(self):
+        return self.formation.enemy_rect(self.row, self.column)
+
+    @property
+    def image(self):
+        return self.formation.images[self.row][self.formation.frame]
+
+
+class IndexedGroup(sprite.Group, metaclass=ABCMeta):
+    # A sprite group that can list the sprites near a rect without testing
+    # all of them
+    @abstractmethod
+    def query(self, rect):
+        pass
+
+    @abstractmethod
+    def ordered(self, sprites):
+        # The given sprites in the group's iteration order
+        pass
+
+    def collide(self, rect):
+        return [s for s in self.query(rect) if rect.colliderect(s.rect)]
+
+
+class GridGroup(IndexedGroup):
+    # Buckets its sprites into a uniform grid, so collision queries only
+    # test sprites in the cells a rect touches. Sprites are re-bucketed when
+    # they move to different cells.
+    def __init__(self, *sprites):
+        self.cells = {}
+        self.spriteCells = {}
+        self.order = {}
+        self.added = 0
+        IndexedGroup.__init__(self, *sprites)
+
+    @staticmethod
+    def cells_for(rect):
+        size = GRID_CELL_SIZE
+        return tuple((x, y)
+                     for x in range(rect.left // size,
+                                    (rect.right - 1) // size + 1)
+                     for y in range(rect.top // size,
+                                    (rect.bottom - 1) // size + 1))
+
+    def add_internal(self, *sprites):
+        super(GridGroup, self).add_internal(*sprites)
+        for s in sprites:
+            self.order[s] = self.added
+            self.added += 1
+            self.spriteCells[s] = ()
+            self.move(s)
 
-    def toggle_image(self):
-        self.index += 1
-        if self.index >= len(self.images):
-            self.index = 0
-        self.image = self.images[self.index]
+    def remove_internal(self, *sprites):
+        super(GridGroup, self).remove_internal(*sprites)
+        for s in sprites:
+            for cell in self.spriteCells.pop(s):
+                bucket = self.cells[cell]
+                bucket.remove(s)
+                if not bucket:
+                    del self.cells[cell]
+            del self.order[s]
+
+    def move(self, s):
+        cells = self.cells_for(s.rect)
+        old = self.spriteCells[s]
+        if cells == old:
+            return
+        for cell in old:
+            bucket = self.cells[cell]
+            bucket.remove(s)
+            if not bucket:
+                del self.cells[cell]
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(s)
+        self.spriteCells[s] = cells
 
     def update(self, *args):
-        game.screen.blit(self.image, self.rect)
-
-    def load_images(self):
-        images = {0: ['1_2', '1_1'],
-                  1: ['2_2', '2_1'],
-                  2: ['2_2', '2_1'],
-                  3: ['3_1', '3_2'],
-                  4: ['3_1', '3_2'],
-                  }
-        img1, img2 = (IMAGES['enemy{}'.format(img_num)] for img_num in
-                      images[self.row])
-        self.images.append(transform.scale(img1, (40, 35)))
-        self.images.append(transform.scale(img2, (40, 35)))
-
-
-class EnemiesGroup(sprite.Group):
-    def __init__(self, columns, rows):
-        sprite.Group.__init__(self)
+        super(GridGroup, self).update(*args)
+        for s in self.sprites():
+            self.move(s)
+
+    def query(self, rect):
+        found = set()
+        for cell in self.cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return found
+
+    def ordered(self, sprites):
+        return sorted(sprites, key=self.order.get)
+
+
+def gridcollide(groupa, groupb, dokilla, dokillb):
+    # Same results as sprite.groupcollide, using whichever group is indexed
+    # to avoid testing every pair
+    crashed = {}
+    if isinstance(groupa, IndexedGroup) and len(groupa) > len(groupb):
+        candidates = set()
+        for b in groupb:
+            candidates.update(groupa.query(b.rect))
+        for a in groupa.ordered(candidates):
+            collision = sprite.spritecollide(a, groupb, dokillb)
+            if collision:
+                crashed[a] = collision
+                if dokilla:
+                    a.kill()
+        return crashed
+    if not isinstance(groupb, IndexedGroup):
+        return sprite.groupcollide(groupa, groupb, dokilla, dokillb)
+    for a in groupa.sprites():
+        collision = groupb.collide(a.rect)
+        if collision:
+            if dokillb:
+                for b in collision:
+                    b.kill()
+            crashed[a] = collision
+            if dokilla:
+                a.kill()
+    return crashed
+
+
+class EnemiesGroup(IndexedGroup):
+    # The formation is one shared offset plus alive counters per row and
+    # column; moving it, finding its edges and its bottom are all O(1).
+    # Sizes, sprites and speeds all come from the wave's tables.
+    def __init__(self, wave, position, current_time):
+        IndexedGroup.__init__(self)
+        columns = wave.columns
+        rows = wave.rows
+        self.wave = wave
         self.enemies = [[None] * columns for _ in range(rows)]
+        # Animation frames per row, shared by every enemy in the row
+        self.images = [[atlas_image(name, (ENEMY_WIDTH, ENEMY_HEIGHT))
+                        for name in frames] for frames in wave.rowFrames]
         self.columns = columns
         self.rows = rows
+        self.x = wave.x
+        self.y = position
+        self.offsetX = 0
+        self.offsetY = 0
+        self.frame = 0
         self.leftAddMove = 0
         self.rightAddMove = 0
-        self.moveTime = 600
+        self.moveTime = wave.moveTimes[-1]
         self.direction = 1
-        self.rightMoves = 30
-        self.leftMoves = 30
-        self.moveNumber = 15
-        self.timer = time.get_ticks()
-        self.bottom = game.enemyPosition + ((rows - 1) * 45) + 35
+        self.rightMoves = wave.sweep
+        self.leftMoves = wave.sweep
+        self.moveNumber = wave.sweep // 2
+        self.timer = current_time
+        self.bottom = position + wave.height
+        self.columnCount = [0] * columns
+        self.rowCount = [0] * rows
+        # One int per row with a bit set for each enemy still alive
+        self.aliveMasks = [0] * rows
         self._aliveColumns = list(range(columns))
         self._leftAliveColumn = 0
         self._rightAliveColumn = columns - 1
+        self._bottomRow = rows - 1
+        self._columnBottoms = [rows - 1] * columns
+
+    def populate(self):
+        # Fills an empty formation; the counters of a full one are copied
+        # from the wave instead of being counted up enemy by enemy
+        wave = self.wave
+        add = super(EnemiesGroup, self).add_internal
+        for row, enemies in enumerate(self.enemies):
+            for column in range(self.columns):
+                enemy = Enemy(row, column)
+                enemy.formation = self
+                add(enemy)
+                enemy.add_internal(self)
+                enemies[column] = enemy
+        self.columnCount = list(wave.columnCounts)
+        self.rowCount = list(wave.rowCounts)
+        self.aliveMasks = list(wave.aliveMasks)
+        self.moveTime = wave.moveTimes[len(self)]
+
+    def get_state(self):
+        return (list(self.aliveMasks), self.x, self.y, self.offsetX,
+                self.offsetY, self.frame, self.leftAddMove, self.rightAddMove,
+                self.moveTime, self.direction, self.rightMoves,
+                self.leftMoves, self.moveNumber, self.timer, self.bottom,
+                self._leftAliveColumn, self._rightAliveColumn,
+                self._bottomRow, self._columnBottoms)
+
+    def set_state(self, state):
+        # Brings back the enemies alive in state, which must include every
+        # enemy alive now, then puts the counters back exactly, including the
+        # ones kill() only ever advances
+        alive = state[0]
+        for row, (old, new) in enumerate(zip(self.aliveMasks, alive)):
+            added = new & ~old
+            column = 0
+            while added:
+                if added & 1:
+                    self.add(Enemy(row, column))
+                added >>= 1
+                column += 1
+        (self.x, self.y, self.offsetX, self.offsetY, self.frame,
+         self.leftAddMove, self.rightAddMove, self.moveTime, self.direction,
+         self.rightMoves, self.leftMoves, self.moveNumber, self.timer,
+         self.bottom, self._leftAliveColumn, self._rightAliveColumn,
+         self._bottomRow, columnBottoms) = state[1:]
+        self._columnBottoms = list(columnBottoms)
+        self._aliveColumns = [column for column in range(self.columns)
+                              if self.columnCount[column]]
+
+    def sprites(self):
+        # Row major, whatever order the enemies were added in
+        return [enemy for row in self.enemies for enemy in row
+                if enemy is not None]
+
+    def frames(self):
+        # (image, rect) for every enemy in row major order, read off the
+        # lattice without going through the sprites
+        x = self.x + self.offsetX
+        y = self.y + self.offsetY
+        columnOffsets = self.wave.columnOffsets
+        rowOffsets = self.wave.rowOffsets
+        frame = self.frame
+        for row, mask in enumerate(self.aliveMasks):
+            if not mask:
+                continue
+            img = self.images[row][frame]
+            top = y + rowOffsets[row]
+            for column, enemy in enumerate(self.enemies[row]):
+                if enemy is not None:
+                    yield img, Rect(x + columnOffsets[column], top,
+                                    ENEMY_WIDTH, ENEMY_HEIGHT)
+
+    def enemy_rect(self, row, column):
+        return Rect(self.x + self.offsetX + self.wave.columnOffsets[column],
+                    self.y + self.offsetY + self.wave.rowOffsets[row],
+                    ENEMY_WIDTH, ENEMY_HEIGHT)
 
     def update(self, current_time):
         if current_time - self.timer > self.moveTime:
@@ -127,30 +566,37 @@ class EnemiesGroup(sprite.Group):
             else:
                 max_move = self.leftMoves + self.leftAddMove
 
+            wave = self.wave
             if self.moveNumber >= max_move:
-                self.leftMoves = 30 + self.rightAddMove
-                self.rightMoves = 30 + self.leftAddMove
+                self.leftMoves = wave.sweep + self.rightAddMove
+                self.rightMoves = wave.sweep + self.leftAddMove
                 self.direction *= -1
                 self.moveNumber = 0
-                self.bottom = 0
-                for enemy in self:
-                    enemy.rect.y += ENEMY_MOVE_DOWN
-                    enemy.toggle_image()
-                    if self.bottom < enemy.rect.y + 35:
-                        self.bottom = enemy.rect.y + 35
+                self.offsetY += wave.moveDown
+                if self:
+                    self.bottom = (self.y + self.offsetY +
+                                   wave.rowOffsets[self._bottomRow] +
+                                   ENEMY_HEIGHT)
+                else:
+                    self.bottom = 0
             else:
-                velocity = 10 if self.direction == 1 else -10
-                for enemy in self:
-                    enemy.rect.x += velocity
-                    enemy.toggle_image()
+                self.offsetX += wave.step * self.direction
                 self.moveNumber += 1
+            self.frame ^= 1
 
             self.timer += self.moveTime
 
     def add_internal(self, *sprites):
+        for s in sprites:
+            if s.formation is None:
+                s.formation = self
+            s.check_group(self)
         super(EnemiesGroup, self).add_internal(*sprites)
         for s in sprites:
             self.enemies[s.row][s.column] = s
+            self.columnCount[s.column] += 1
+            self.rowCount[s.row] += 1
+            self.aliveMasks[s.row] |= 1 << s.column
 
     def remove_internal(self, *sprites):
         super(EnemiesGroup, self).remove_internal(*sprites)
@@ -158,78 +604,200 @@ class EnemiesGroup(sprite.Group):
             self.kill(s)
         self.update_speed()
 
+    def query(self, rect):
+        # Enemies sit on a regular lattice, so the ones a rect can touch
+        # follow directly from its position relative to the formation
+        spacingX = self.wave.spacingX
+        spacingY = self.wave.spacingY
+        left = rect.left - self.x - self.offsetX
+        top = rect.top - self.y - self.offsetY
+        first_column = max((left - ENEMY_WIDTH) // spacingX + 1, 0)
+        last_column = min((left + rect.width - 1) // spacingX,
+                          self.columns - 1)
+        first_row = max((top - ENEMY_HEIGHT) // spacingY + 1, 0)
+        last_row = min((top + rect.height - 1) // spacingY, self.rows - 1)
+        return set(self.enemies[row][column]
+                   for row in range(first_row, last_row + 1)
+                   for column in range(first_column, last_column + 1)
+                   if self.enemies[row][column] is not None)
+
+    def ordered(self, sprites):
+        return sorted(sprites, key=lambda s: (s.row, s.column))
+
     def is_column_dead(self, column):
-        return not any(self.enemies[row][column]
-                       for row in range(self.rows))
+        return not self.columnCount[column]
 
-    def random_bottom(self):
-        col = choice(self._aliveColumns)
-        col_enemies = (self.enemies[row - 1][col]
-                       for row in range(self.rows, 0, -1))
-        return next((en for en in col_enemies if en is not None), None)
+    def random_bottom(self, rng):
+        col = rng.choice(self._aliveColumns)
+        return self.enemies[self._columnBottoms[col]][col]
 
     def update_speed(self):
-        if len(self) == 1:
-            self.moveTime = 200
-        elif len(self) <= 10:
-            self.moveTime = 400
+        self.moveTime = self.wave.moveTimes[len(self)]
 
     def kill(self, enemy):
         self.enemies[enemy.row][enemy.column] = None
+        self.columnCount[enemy.column] -= 1
+        self.rowCount[enemy.row] -= 1
+        self.aliveMasks[enemy.row] &= ~(1 << enemy.column)
+        while self._bottomRow > 0 and not self.rowCount[self._bottomRow]:
+            self._bottomRow -= 1
+        column_bottom = self._columnBottoms[enemy.column]
+        while column_bottom > 0 and \
+                self.enemies[column_bottom][enemy.column] is None:
+            column_bottom -= 1
+        self._columnBottoms[enemy.column] = column_bottom
+
         is_column_dead = self.is_column_dead(enemy.column)
         if is_column_dead:
-            self._aliveColumns.remove(enemy.column)
+            del self._aliveColumns[bisect_left(self._aliveColumns,
+                                               enemy.column)]
 
         if enemy.column == self._rightAliveColumn:
             while self._rightAliveColumn > 0 and is_column_dead:
                 self._rightAliveColumn -= 1
-                self.rightAddMove += 5
+                self.rightAddMove += self.wave.addMove
                 is_column_dead = self.is_column_dead(self._rightAliveColumn)
 
         elif enemy.column == self._leftAliveColumn:
             while self._leftAliveColumn < self.columns and is_column_dead:
                 self._leftAliveColumn += 1
-                self.leftAddMove += 5
+                self.leftAddMove += self.wave.addMove
                 is_column_dead = self.is_column_dead(self._leftAliveColumn)
 
 
-class Blocker(sprite.Sprite):
-    def __init__(self, size, color, row, column):
+class Shield(sprite.Sprite):
+    # A whole shield as a bit grid, one int per row of cells. The surface is
+    # only built once something draws it, and destroyed cells are punched out
+    # of it in place. A cell size below BLOCKER_SIZE erodes finer holes.
+    __slots__ = ('cellSize', 'columns', 'rows', 'cells', 'color', 'rect',
+                 '_image')
+
+    def __init__(self, xpos, ypos, color, cellSize=BLOCKER_SIZE):
         sprite.Sprite.__init__(self)
-        self.height = size
-        self.width = size
+        width = SHIELD_COLUMNS * BLOCKER_SIZE
+        height = SHIELD_ROWS * BLOCKER_SIZE
+        if width % cellSize or height % cellSize:
+            raise ValueError('cell size {} does not divide a {}x{} '
+                             'shield'.format(cellSize, width, height))
+        self.cellSize = cellSize
+        self.columns = width // cellSize
+        self.rows = height // cellSize
+        self.cells = [(1 << self.columns) - 1] * self.rows
         self.color = color
-        self.image = Surface((self.width, self.height))
-        self.image.fill(self.color)
-        self.rect = self.image.get_rect()
-        self.row = row
-        self.column = column
-
-    def update(self, keys, *args):
-        game.screen.blit(self.image, self.rect)
+        self.rect = Rect(xpos, ypos, width, height)
+        self._image = None
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Surface(self.rect.size)
+            self._image.fill(self.color)
+            self._image.set_colorkey((0, 0, 0))
+            full = (1 << self.columns) - 1
+            for row, cells in enumerate(self.cells):
+                self.punch(row, full & ~cells)
+        return self._image
+
+    def pack(self):
+        width = (self.columns + 7) // 8
+        return b''.join(cells.to_bytes(width, 'little')
+                        for cells in self.cells)
+
+    def unpack(self, data, offset):
+        # Reads the rows written by pack(); returns the offset past them
+        width = (self.columns + 7) // 8
+        end = offset + width * self.rows
+        cells = [int.from_bytes(data[start:start + width], 'little')
+                 for start in range(offset, end, width)]
+        if cells != self.cells:
+            self.cells = cells
+            self._image = None
+        return end
+
+    def cell_rects(self, row, cells):
+        size = self.cellSize
+        column = 0
+        while cells:
+            if cells & 1:
+                yield Rect(column * size, row * size, size, size)
+            cells >>= 1
+            column += 1
+
+    def punch(self, row, cells):
+        for rect in self.cell_rects(row, cells):
+            self._image.fill((0, 0, 0), rect)
+
+    def erode(self, rect):
+        # Destroys every cell rect overlaps; returns them as (row, cells)
+        # pairs, empty if there were none
+        size = self.cellSize
+        left = max((rect.left - self.rect.left) // size, 0)
+        right = min((rect.right - 1 - self.rect.left) // size,
+                    self.columns - 1)
+        top = max((rect.top - self.rect.top) // size, 0)
+        bottom = min((rect.bottom - 1 - self.rect.top) // size, self.rows - 1)
+        if left > right or top > bottom:
+            return []
+        mask = ((1 << (right - left + 1)) - 1) << left
+        hit = []
+        for row in range(top, bottom + 1):
+            cells = self.cells[row] & mask
+            if cells:
+                hit.append((row, cells))
+                self.cells[row] &= ~mask
+                if self._image is not None:
+                    self.punch(row, cells)
+        return hit
+
+
+def shieldcollide(group, shields, dokill, destroyed=None):
+    # Same results as sprite.groupcollide against one sprite per cell.
+    # Shields are far apart, so each can be resolved on its own as long as
+    # its sprites are visited in group order. The cells destroyed are added
+    # to destroyed as (shield, row, cells) when it is given.
+    hits = []
+    if isinstance(group, IndexedGroup) and len(group) > len(shields):
+        pairs = ((shield, s) for shield in shields
+                 for s in group.ordered(group.query(shield.rect)))
+    else:
+        pairs = ((shield, s) for s in group.sprites() for shield in shields
+                 if shield.rect.colliderect(s.rect))
+    for shield, s in pairs:
+        cells = shield.erode(s.rect)
+        if cells:
+            hits.append(s)
+            if destroyed is not None:
+                destroyed.extend((shield, row, mask) for row, mask in cells)
+    if dokill:
+        for s in hits:
+            s.kill()
 
 
 class Mystery(sprite.Sprite):
-    def __init__(self):
+    __slots__ = ('image', 'rect', 'moveTime', 'direction', 'timer', 'moving',
+                 'entered')
+
+    def __init__(self, current_time):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['mystery']
-        self.image = transform.scale(self.image, (75, 35))
+        self.image = atlas_image('mystery', (75, 35))
         self.rect = self.image.get_rect(topleft=(-80, 45))
-        self.row = 5
         self.moveTime = 25000
         self.direction = 1
-        self.timer = time.get_ticks()
+        self.timer = current_time
+        # True for the frame a pass across the screen starts
+        self.moving = False
+        self.entered = False
 
-    def update(self, keys, currentTime, *args):
+    def update(self, currentTime, *args):
         resetTimer = False
         passed = currentTime - self.timer
+        self.entered = passed > self.moveTime and not self.moving
+        self.moving = passed > self.moveTime
         if passed > self.moveTime:
             if self.rect.x < 840 and self.direction == 1:
                 self.rect.x += 2
-                game.screen.blit(self.image, self.rect)
             if self.rect.x > -100 and self.direction == -1:
                 self.rect.x -= 2
-                game.screen.blit(self.image, self.rect)
 
         if self.rect.x > 830:
             self.direction = -1
@@ -241,74 +809,127 @@ class Mystery(sprite.Sprite):
             self.timer = currentTime
 
 
-class EnemyExplosion(sprite.Sprite):
-    def __init__(self, enemy, *groups):
-        super(EnemyExplosion, self).__init__(*groups)
-        self.image = transform.scale(self.get_image(enemy.row), (40, 35))
-        self.image2 = transform.scale(self.get_image(enemy.row), (50, 45))
-        self.rect = self.image.get_rect(topleft=(enemy.rect.x, enemy.rect.y))
-        self.timer = time.get_ticks()
+class EnemyExplosion(PooledSprite):
+    __slots__ = ('name', 'image', 'image2', 'rect', 'timer', 'passed')
 
-    @staticmethod
-    def get_image(row):
-        img_colors = ['purple', 'blue', 'blue', 'green', 'green']
-        return IMAGES['explosion{}'.format(img_colors[row])]
+    def __init__(self, name, xpos, ypos, current_time, *groups):
+        super(EnemyExplosion, self).__init__()
+        self.rect = Rect(0, 0, 40, 35)
+        self.activate(name, xpos, ypos, current_time, *groups)
+
+    def activate(self, name, xpos, ypos, current_time, *groups):
+        self.name = name
+        self.image = atlas_image(name, (40, 35))
+        self.image2 = atlas_image(name, (50, 45))
+        self.rect.topleft = (xpos, ypos)
+        self.timer = current_time
+        self.passed = 0
+        self.add(*groups)
 
     def update(self, current_time, *args):
-        passed = current_time - self.timer
-        if passed <= 100:
-            game.screen.blit(self.image, self.rect)
-        elif passed <= 200:
-            game.screen.blit(self.image2, (self.rect.x - 6, self.rect.y - 6))
-        elif 400 < passed:
+        self.passed = current_time - self.timer
+        if 400 < self.passed:
             self.kill()
 
+    def frame(self):
+        if self.passed <= 100:
+            return self.image, self.rect
+        elif self.passed <= 200:
+            return self.image2, self.image2.get_rect(
+                topleft=(self.rect.x - 6, self.rect.y - 6))
 
-class MysteryExplosion(sprite.Sprite):
-    def __init__(self, mystery, score, *groups):
-        super(MysteryExplosion, self).__init__(*groups)
-        self.text = Text(FONT, 20, str(score), WHITE,
-                         mystery.rect.x + 20, mystery.rect.y + 6)
-        self.timer = time.get_ticks()
+
+class MysteryExplosion(PooledSprite):
+    __slots__ = ('score', 'rect', 'text', 'timer', 'passed')
+
+    def __init__(self, score, xpos, ypos, current_time, *groups):
+        super(MysteryExplosion, self).__init__()
+        self.rect = Rect(0, 0, 0, 0)
+        self.activate(score, xpos, ypos, current_time, *groups)
+
+    def activate(self, score, xpos, ypos, current_time, *groups):
+        self.score = score
+        self.rect.topleft = (xpos, ypos)
+        self.text = None
+        self.timer = current_time
+        self.passed = 0
+        self.add(*groups)
 
     def update(self, current_time, *args):
-        passed = current_time - self.timer
-        if passed <= 200 or 400 < passed <= 600:
-            self.text.draw(game.screen)
-        elif 600 < passed:
+        self.passed = current_time - self.timer
+        if 600 < self.passed:
             self.kill()
 
+    def frame(self):
+        if self.passed <= 200 or 400 < self.passed <= 600:
+            if self.text is None:
+                self.text = Text(FONT, 20, str(self.score), WHITE,
+                                 self.rect.x, self.rect.y)
+            return self.text.surface, self.text.rect
 
-class ShipExplosion(sprite.Sprite):
-    def __init__(self, ship, *groups):
-        super(ShipExplosion, self).__init__(*groups)
-        self.image = IMAGES['ship']
-        self.rect = self.image.get_rect(topleft=(ship.rect.x, ship.rect.y))
-        self.timer = time.get_ticks()
+
+class ShipExplosion(PooledSprite):
+    __slots__ = ('image', 'rect', 'timer', 'passed')
+
+    def __init__(self, xpos, ypos, current_time, *groups):
+        super(ShipExplosion, self).__init__()
+        self.image = atlas_image('ship')
+        self.rect = self.image.get_rect()
+        self.activate(xpos, ypos, current_time, *groups)
+
+    def activate(self, xpos, ypos, current_time, *groups):
+        self.rect.topleft = (xpos, ypos)
+        self.timer = current_time
+        self.passed = 0
+        self.add(*groups)
 
     def update(self, current_time, *args):
-        passed = current_time - self.timer
-        if 300 < passed <= 600:
-            game.screen.blit(self.image, self.rect)
-        elif 900 < passed:
+        self.passed = current_time - self.timer
+        if 900 < self.passed:
             self.kill()
 
+    def frame(self):
+        if 300 < self.passed <= 600:
+            return self.image, self.rect
+
 
 class Life(sprite.Sprite):
+    __slots__ = ('image', 'rect')
+
     def __init__(self, xpos, ypos):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['ship']
-        self.image = transform.scale(self.image, (23, 23))
+        self.image = atlas_image('ship', (23, 23))
         self.rect = self.image.get_rect(topleft=(xpos, ypos))
 
-    def update(self, *args):
-        game.screen.blit(self.image, self.rect)
+
+FONTS = {}
+TEXT_SURFACES = OrderedDict()
+
+
+def get_font(textFont, size):
+    key = (textFont, size)
+    if key not in FONTS:
+        FONTS[key] = font.Font(textFont, size)
+    return FONTS[key]
+
+
+def render_text(textFont, size, message, color):
+    # Rendered glyphs are kept in a bounded LRU, so redrawing the same text
+    # costs a dict lookup instead of a font render
+    key = (textFont, size, message, color)
+    surface = TEXT_SURFACES.pop(key, None)
+    if surface is None:
+        surface = get_font(textFont, size).render(message, True, color)
+        if len(TEXT_SURFACES) >= TEXT_CACHE_SIZE:
+            TEXT_SURFACES.popitem(last=False)
+    TEXT_SURFACES[key] = surface
+    return surface
 
 
 class Text(object):
     def __init__(self, textFont, size, message, color, xpos, ypos):
-        self.font = font.Font(textFont, size)
-        self.surface = self.font.render(message, True, color)
+        self.font = get_font(textFont, size)
+        self.surface = render_text(textFont, size, message, color)
         self.rect = self.surface.get_rect(topleft=(xpos, ypos))
 
     def draw(self, surface):
@@ -316,209 +937,809 @@ class Text(object):
 
 
 class SpaceInvaders(object):
-    def __init__(self):
-        # It seems, in Linux buffersize=512 is not enough, use 4096 to prevent:
-        #   ALSA lib pcm.c:7963:(snd_pcm_recover) underrun occurred
-        init()
-        self.clock = time.Clock()
-        self.caption = display.set_caption('Space Invaders')
-        self.screen = SCREEN
-        self.background = image.load(IMAGE_PATH + 'background.jpg').convert()
-        self.startGame = False
-        self.mainScreen = True
-        self.gameOver = False
+    # The game rules only; nothing here touches the display, so it can be
+    # stepped headless as fast as the CPU allows. Time comes from the
+    # injected clock, which step() advances by one frame.
+    def __init__(self, clock=None, seed=None, shield_cell_size=BLOCKER_SIZE,
+                 audio=None, waves=None, events=None):
+        self.clock = clock if clock is not None else TickClock()
+        # Gameplay events for analytics; the null stream ignores them
+        self.events = events if events is not None else NULL_EVENTS
+        # Formations for every round, compiled from a wave file
+        self.waves = waves if waves is not None else load_waves()
+        # Sounds are requested by name; the null backend ignores them
+        self.audio = audio if audio is not None else NULL_AUDIO
+        self.seed = seed
+        self.random = Random(seed)
+        self.shieldCellSize = shield_cell_size
+        self.bulletPool = SpritePool(Bullet, BULLET_POOL_SIZE)
+        self.enemyExplosionPool = SpritePool(EnemyExplosion,
+                                             EXPLOSION_POOL_SIZE)
+        self.mysteryExplosionPool = SpritePool(MysteryExplosion,
+                                               EXPLOSION_POOL_SIZE)
+        self.shipExplosionPool = SpritePool(ShipExplosion,
+                                            EXPLOSION_POOL_SIZE)
+        self.bullets = sprite.Group()
+        self.enemyBullets = GridGroup()
+        self.explosionsGroup = sprite.Group()
+        self.profiler = None
+        self.new_game()
+
+    def new_game(self):
+        # Only create blockers on a new game, not a new round
+        self.allBlockers = sprite.Group(self.make_shield(0),
+                                        self.make_shield(1),
+                                        self.make_shield(2),
+                                        self.make_shield(3))
         # Counter for enemy starting position (increased each new round)
-        self.enemyPosition = ENEMY_DEFAULT_POSITION
-        self.titleText = Text(FONT, 50, 'Space Invaders', WHITE, 164, 155)
-        self.titleText2 = Text(FONT, 25, 'Press any key to continue', WHITE,
-                               201, 225)
-        self.gameOverText = Text(FONT, 50, 'Game Over', WHITE, 250, 270)
-        self.nextRoundText = Text(FONT, 50, 'Next Round', WHITE, 240, 270)
-        self.enemy1Text = Text(FONT, 25, '   =   10 pts', GREEN, 368, 270)
-        self.enemy2Text = Text(FONT, 25, '   =  20 pts', BLUE, 368, 320)
-        self.enemy3Text = Text(FONT, 25, '   =  30 pts', PURPLE, 368, 370)
-        self.enemy4Text = Text(FONT, 25, '   =  ?????', RED, 368, 420)
-        self.scoreText = Text(FONT, 20, 'Score', WHITE, 5, 5)
-        self.livesText = Text(FONT, 20, 'Lives ', WHITE, 640, 5)
-
-        self.life1 = Life(715, 3)
-        self.life2 = Life(742, 3)
-        self.life3 = Life(769, 3)
-        self.livesGroup = sprite.Group(self.life1, self.life2, self.life3)
+        self.round = 0
+        self.enemyPosition = self.waves.start
+        self.lives = 3
+        self.gameOver = False
+        self.reset(0)
+        self.gameTimer = self.clock.get_ticks()
 
     def reset(self, score):
+        currentTime = self.clock.get_ticks()
         self.player = Ship()
         self.playerGroup = sprite.Group(self.player)
-        self.explosionsGroup = sprite.Group()
-        self.bullets = sprite.Group()
-        self.mysteryShip = Mystery()
+        # Hand leftovers from the last round back to their pools
+        for group in (self.explosionsGroup, self.bullets, self.enemyBullets):
+            for s in group.sprites():
+                s.kill()
+        self.mysteryShip = Mystery(currentTime)
         self.mysteryGroup = sprite.Group(self.mysteryShip)
-        self.enemyBullets = sprite.Group()
-        self.make_enemies()
-        self.allSprites = sprite.Group(self.player, self.enemies,
-                                       self.livesGroup, self.mysteryShip)
-        self.keys = key.get_pressed()
+        self.make_enemies(currentTime)
 
-        self.timer = time.get_ticks()
-        self.noteTimer = time.get_ticks()
-        self.shipTimer = time.get_ticks()
+        self.timer = currentTime
+        self.noteTimer = currentTime
+        self.noteIndex = 0
+        self.shipTimer = currentTime
         self.score = score
         self.makeNewShip = False
         self.shipAlive = True
 
-    def make_blockers(self, number):
-        blockerGroup = sprite.Group()
-        for row in range(4):
-            for column in range(9):
-                blocker = Blocker(10, GREEN, row, column)
-                blocker.rect.x = 50 + (200 * number) + (column * blocker.width)
-                blocker.rect.y = BLOCKERS_POSITION + (row * blocker.height)
-                blockerGroup.add(blocker)
-        return blockerGroup
-
-    @staticmethod
-    def should_exit(evt):
-        # type: (pygame.event.EventType) -> bool
-        return evt.type == QUIT or (evt.type == KEYUP and evt.key == K_ESCAPE)
-
-    def check_input(self):
-        self.keys = key.get_pressed()
-        for e in event.get():
-            if self.should_exit(e):
-                sys.exit()
-            if e.type == KEYDOWN:
-                if e.key == K_SPACE:
-                    if len(self.bullets) == 0 and self.shipAlive:
-                        if self.score < 1000:
-                            bullet = Bullet(self.player.rect.x + 23,
-                                            self.player.rect.y + 5, -1,
-                                            15, 'laser', 'center')
-                            self.bullets.add(bullet)
-                            self.allSprites.add(self.bullets)
-                        else:
-                            leftbullet = Bullet(self.player.rect.x + 8,
-                                                self.player.rect.y + 5, -1,
-                                                15, 'laser', 'left')
-                            rightbullet = Bullet(self.player.rect.x + 38,
-                                                 self.player.rect.y + 5, -1,
-                                                 15, 'laser', 'right')
-                            self.bullets.add(leftbullet)
-                            self.bullets.add(rightbullet)
-                            self.allSprites.add(self.bullets)
-
-    def make_enemies(self):
-        enemies = EnemiesGroup(10, 5)
-        for row in range(5):
-            for column in range(10):
-                enemy = Enemy(row, column)
-                enemy.rect.x = 157 + (column * 50)
-                enemy.rect.y = self.enemyPosition + (row * 45)
-                enemies.add(enemy)
-
+    def is_round_over(self):
+        return not self.enemies and not self.explosionsGroup
+
+    def pool_stats(self):
+        return {'bullets': self.bulletPool.stats(),
+                'enemy_explosions': self.enemyExplosionPool.stats(),
+                'mystery_explosions': self.mysteryExplosionPool.stats(),
+                'ship_explosions': self.shipExplosionPool.stats()}
+
+    def step(self, action=ACTION_NONE):
+        # Advance the game by one frame; returns (reward, done)
+        score = self.score
+        if not self.gameOver:
+            currentTime = self.clock.get_ticks()
+            if self.is_round_over():
+                if currentTime - self.gameTimer > 3000:
+                    self.events.emit(ROUND_CLEARED, self.clock.frame,
+                                     self.round, 0, self.score)
+                    # Move enemies closer to bottom
+                    self.round += 1
+                    self.enemyPosition += self.waves.roundDrop
+                    self.reset(self.score)
+                    self.gameTimer += 3000
+            else:
+                self.check_input(action)
+                self.update_enemies(currentTime)
+                self.update_sprites(action, currentTime)
+                self.update_explosions(currentTime)
+                self.check_collisions(currentTime)
+                self.create_new_ship(self.makeNewShip, currentTime)
+                self.make_enemies_shoot(currentTime)
+                self.play_march(currentTime)
+            self.clock.tick()
+        return self.score - score, self.gameOver
+
+    def step_repeat(self, action, repeat):
+        # Holds one action for up to repeat frames, as agents that act every
+        # few frames do; stops early when the game ends
+        reward = 0
+        done = self.gameOver
+        for _ in range(repeat):
+            gained, done = self.step(action)
+            reward += gained
+            if done:
+                break
+        return reward, done
+
+    def snapshot(self):
+        # Everything step() depends on, packed into one bytes object that
+        # restore() reads back. Nothing references a sprite or a surface, so
+        # a snapshot can be kept, copied or restored into any game.
+        player = self.player
+        mystery = self.mysteryShip
+        enemies = self.enemies
+        enemiesState = enemies.get_state()
+        explosions = []
+        for explosion in self.explosionsGroup:
+            if isinstance(explosion, EnemyExplosion):
+                kind, arg = 0, self.waves.explosions.index(explosion.name)
+            elif isinstance(explosion, MysteryExplosion):
+                kind, arg = 1, explosion.score
+            else:
+                kind, arg = 2, 0
+            explosions.append(EXPLOSION_STATE.pack(
+                kind, arg, explosion.rect.x, explosion.rect.y,
+                explosion.timer, explosion.passed))
+        randomState = self.random.getstate()[1]
+        return b''.join([
+            SNAPSHOT_HEADER.pack(
+                self.clock.frame, self.score, self.lives, self.gameOver,
+                self.round, self.enemyPosition, self.gameTimer, self.timer,
+                self.noteTimer, self.shipTimer, self.noteIndex,
+                self.makeNewShip, self.shipAlive, player.rect.x,
+                player.alive(), mystery.rect.x, mystery.direction,
+                mystery.timer, mystery.alive(), mystery.moving,
+                len(self.bullets), len(self.enemyBullets), len(explosions)),
+            RANDOM_STATE.pack(*randomState),
+            enemies_state(enemies.rows, enemies.columns).pack(
+                b''.join(mask.to_bytes(mask_bytes(enemies.columns), 'little')
+                         for mask in enemiesState[0]),
+                *(enemiesState[1:-1] + tuple(enemiesState[-1]))),
+            b''.join(bullet_state(bullet) for bullet in self.bullets),
+            b''.join(bullet_state(bullet) for bullet in self.enemyBullets),
+            b''.join(explosions),
+            b''.join(shield.pack() for shield in self.allBlockers)])
+
+    def restore(self, snapshot):
+        # Existing sprites are reused where they can be, so restoring into a
+        # game that was just stepped on from the same snapshot is cheap
+        offset = SNAPSHOT_HEADER.size
+        mystery = self.mysteryShip
+        (self.clock.frame, self.score, self.lives, self.gameOver,
+         self.round, self.enemyPosition, self.gameTimer, self.timer,
+         self.noteTimer, self.shipTimer, self.noteIndex, self.makeNewShip,
+         self.shipAlive, playerX, playerAlive, mysteryX, mysteryDirection,
+         mysteryTimer, mysteryAlive, mystery.moving, bulletCount,
+         enemyBulletCount,
+         explosionCount) = SNAPSHOT_HEADER.unpack_from(snapshot)
+        self.random.setstate((3, RANDOM_STATE.unpack_from(snapshot, offset),
+                              None))
+        offset += RANDOM_STATE.size
+
+        self.player.rect.x = playerX
+        if playerAlive != self.player.alive():
+            if playerAlive:
+                self.playerGroup.add(self.player)
+            else:
+                self.player.kill()
+        mystery.rect.x = mysteryX
+        mystery.direction = mysteryDirection
+        mystery.timer = mysteryTimer
+        if mysteryAlive != mystery.alive():
+            if mysteryAlive:
+                self.mysteryGroup.add(mystery)
+            else:
+                mystery.kill()
+
+        wave = self.waves.wave(self.round)
+        rows, columns = wave.rows, wave.columns
+        fmt = enemies_state(rows, columns)
+        values = fmt.unpack_from(snapshot, offset)
+        offset += fmt.size
+        size = mask_bytes(columns)
+        masks = values[0]
+        alive = [int.from_bytes(masks[i:i + size], 'little')
+                 for i in range(0, len(masks), size)]
+        if self.enemies.wave is not wave or any(
+                old & ~new
+                for old, new in zip(self.enemies.aliveMasks, alive)):
+            # Enemies can only be brought back, so start from an empty group
+            self.enemies = EnemiesGroup(wave, self.enemyPosition, 0)
+        self.enemies.set_state((alive,) + values[1:-columns] +
+                               (values[-columns:],))
+
+        for group in (self.explosionsGroup, self.bullets, self.enemyBullets):
+            for s in group.sprites():
+                s.kill()
+        for group, count in ((self.bullets, bulletCount),
+                             (self.enemyBullets, enemyBulletCount)):
+            for _ in range(count):
+                xpos, ypos, direction, speed, kind = \
+                    BULLET_STATE.unpack_from(snapshot, offset)
+                offset += BULLET_STATE.size
+                group.add(self.bulletPool.acquire(xpos, ypos, direction,
+                                                  speed, *BULLET_KINDS[kind]))
+        for _ in range(explosionCount):
+            kind, arg, xpos, ypos, timer, passed = \
+                EXPLOSION_STATE.unpack_from(snapshot, offset)
+            offset += EXPLOSION_STATE.size
+            if kind == 0:
+                explosion = self.enemyExplosionPool.acquire(
+                    self.waves.explosions[arg], xpos, ypos, timer,
+                    self.explosionsGroup)
+            elif kind == 1:
+                explosion = self.mysteryExplosionPool.acquire(
+                    arg, xpos, ypos, timer, self.explosionsGroup)
+            else:
+                explosion = self.shipExplosionPool.acquire(
+                    xpos, ypos, timer, self.explosionsGroup)
+            explosion.passed = passed
+
+        for shield in self.allBlockers:
+            offset = shield.unpack(snapshot, offset)
+
+    def update_enemies(self, currentTime):
+        self.enemies.update(currentTime)
+
+    def update_sprites(self, action, currentTime):
+        self.playerGroup.update(action)
+        self.mysteryGroup.update(currentTime)
+        self.bullets.update()
+        self.enemyBullets.update()
+        if self.mysteryShip.entered:
+            self.audio.play('mysteryentered', fadeout=4000)
+
+    def update_explosions(self, currentTime):
+        self.explosionsGroup.update(currentTime)
+
+    def play_march(self, currentTime):
+        # One note per formation move, so the march speeds up with it
+        if currentTime - self.noteTimer > self.enemies.moveTime:
+            self.audio.play_note(self.noteIndex)
+            self.noteIndex = (self.noteIndex + 1) % NOTE_COUNT
+            self.noteTimer += self.enemies.moveTime
+
+    def set_profiler(self, profiler, end_frames=True):
+        # Times each phase of step() on this instance only; with no profiler
+        # attached step() calls the plain methods. With end_frames the frame
+        # is closed after every step, otherwise the caller closes it, e.g.
+        # after rendering.
+        attrs = PROFILED_PHASES + ('step',)
+        if self.profiler is not None:
+            self.profiler.uninstrument(self, attrs)
+        self.profiler = profiler
+        if profiler is None:
+            return
+        profiler.instrument(self, PROFILED_PHASES)
+        step = profiler.wrap('step', self.step)
+        if end_frames:
+            def profiled_step(action=ACTION_NONE):
+                result = step(action)
+                profiler.end_frame(self.sprite_counts())
+                return result
+            self.step = profiled_step
+        else:
+            self.step = step
+
+    def sprite_counts(self):
+        return OrderedDict([('enemies', len(self.enemies)),
+                            ('bullets', len(self.bullets)),
+                            ('enemy_bullets', len(self.enemyBullets)),
+                            ('explosions', len(self.explosionsGroup)),
+                            ('mystery', len(self.mysteryGroup))])
+
+    def make_shield(self, number):
+        return Shield(50 + (200 * number), BLOCKERS_POSITION, GREEN,
+                      self.shieldCellSize)
+
+    def check_input(self, action):
+        if action & ACTION_FIRE:
+            if len(self.bullets) == 0 and self.shipAlive:
+                if self.score < 1000:
+                    bullet = self.bulletPool.acquire(self.player.rect.x + 23,
+                                                     self.player.rect.y + 5,
+                                                     -1, 15, 'laser', 'center')
+                    self.bullets.add(bullet)
+                    self.audio.play('shoot')
+                    self.events.emit(SHOT_FIRED, self.clock.frame,
+                                     bullet.rect.x, bullet.rect.y, 1)
+                else:
+                    leftbullet = self.bulletPool.acquire(
+                        self.player.rect.x + 8, self.player.rect.y + 5, -1,
+                        15, 'laser', 'left')
+                    rightbullet = self.bulletPool.acquire(
+                        self.player.rect.x + 38, self.player.rect.y + 5, -1,
+                        15, 'laser', 'right')
+                    self.bullets.add(leftbullet)
+                    self.bullets.add(rightbullet)
+                    self.audio.play('shoot2')
+                    self.events.emit(SHOT_FIRED, self.clock.frame,
+                                     self.player.rect.x + 23,
+                                     self.player.rect.y + 5, 2)
+
+    def make_enemies(self, currentTime):
+        enemies = EnemiesGroup(self.waves.wave(self.round),
+                               self.enemyPosition, currentTime)
+        enemies.populate()
         self.enemies = enemies
 
-    def make_enemies_shoot(self):
-        if (time.get_ticks() - self.timer) > 700 and self.enemies:
-            enemy = self.enemies.random_bottom()
+    def make_enemies_shoot(self, currentTime):
+        if (currentTime - self.timer) > 700 and self.enemies:
+            enemy = self.enemies.random_bottom(self.random)
             self.enemyBullets.add(
-                Bullet(enemy.rect.x + 14, enemy.rect.y + 20, 1, 5,
-                       'enemylaser', 'center'))
-            self.allSprites.add(self.enemyBullets)
-            self.timer = time.get_ticks()
-
-    def calculate_score(self, row):
-        scores = {0: 30,
-                  1: 20,
-                  2: 20,
-                  3: 10,
-                  4: 10,
-                  5: choice([50, 100, 150, 300])
-                  }
-
-        score = scores[row]
+                self.bulletPool.acquire(enemy.rect.x + 14, enemy.rect.y + 20,
+                                        1, 5, 'enemylaser', 'center'))
+            self.events.emit(ENEMY_SHOT, self.clock.frame, enemy.row,
+                             enemy.column)
+            self.timer = currentTime
+
+    def calculate_score(self, row=None):
+        # An enemy in the given row of the formation, or the mystery ship
+        if row is None:
+            score = self.random.choice(self.waves.mysteryScores)
+        else:
+            score = self.enemies.wave.rowScores[row]
         self.score += score
         return score
 
-    def create_main_menu(self):
-        self.enemy1 = IMAGES['enemy3_1']
-        self.enemy1 = transform.scale(self.enemy1, (40, 40))
-        self.enemy2 = IMAGES['enemy2_2']
-        self.enemy2 = transform.scale(self.enemy2, (40, 40))
-        self.enemy3 = IMAGES['enemy1_2']
-        self.enemy3 = transform.scale(self.enemy3, (40, 40))
-        self.enemy4 = IMAGES['mystery']
-        self.enemy4 = transform.scale(self.enemy4, (80, 40))
-        self.screen.blit(self.enemy1, (318, 270))
-        self.screen.blit(self.enemy2, (318, 320))
-        self.screen.blit(self.enemy3, (318, 370))
-        self.screen.blit(self.enemy4, (299, 420))
-
-    def check_collisions(self):
-        sprite.groupcollide(self.bullets, self.enemyBullets, True, True)
-
-        for enemy in sprite.groupcollide(self.enemies, self.bullets,
-                                         True, True).keys():
-            self.calculate_score(enemy.row)
-            EnemyExplosion(enemy, self.explosionsGroup)
-            self.gameTimer = time.get_ticks()
+    def check_collisions(self, currentTime):
+        gridcollide(self.bullets, self.enemyBullets, True, True)
+
+        for enemy in gridcollide(self.enemies, self.bullets,
+                                 True, True).keys():
+            self.audio.play('invaderkilled')
+            score = self.calculate_score(enemy.row)
+            self.events.emit(ENEMY_KILLED, self.clock.frame, enemy.row,
+                             enemy.column, score)
+            rect = enemy.rect
+            self.enemyExplosionPool.acquire(
+                self.enemies.wave.rowExplosions[enemy.row], rect.x, rect.y,
+                currentTime, self.explosionsGroup)
+            self.gameTimer = currentTime
 
         for mystery in sprite.groupcollide(self.mysteryGroup, self.bullets,
                                            True, True).keys():
-            mystery.mysteryEntered.stop()
-            score = self.calculate_score(mystery.row)
-            MysteryExplosion(mystery, score, self.explosionsGroup)
-            newShip = Mystery()
-            self.allSprites.add(newShip)
-            self.mysteryGroup.add(newShip)
-
-        for player in sprite.groupcollide(self.playerGroup, self.enemyBullets,
-                                          True, True).keys():
-            if self.life3.alive():
-                self.life3.kill()
-            elif self.life2.alive():
-                self.life2.kill()
-            elif self.life1.alive():
-                self.life1.kill()
+            self.audio.stop('mysteryentered')
+            self.audio.play('mysterykilled')
+            score = self.calculate_score()
+            self.events.emit(MYSTERY_HIT, self.clock.frame, mystery.rect.x,
+                             0, score)
+            self.mysteryExplosionPool.acquire(score, mystery.rect.x + 20,
+                                              mystery.rect.y + 6, currentTime,
+                                              self.explosionsGroup)
+            self.mysteryShip = Mystery(currentTime)
+            self.mysteryGroup.add(self.mysteryShip)
+
+        for player in gridcollide(self.playerGroup, self.enemyBullets,
+                                  True, True).keys():
+            self.audio.play('shipexplosion')
+            if self.lives:
+                self.lives -= 1
             else:
                 self.gameOver = True
-                self.startGame = False
-            ShipExplosion(player, self.explosionsGroup)
+            self.events.emit(SHIP_DESTROYED, self.clock.frame, player.rect.x,
+                             0, self.lives)
+            self.shipExplosionPool.acquire(player.rect.x, player.rect.y,
+                                           currentTime, self.explosionsGroup)
             self.makeNewShip = True
-            self.shipTimer = time.get_ticks()
+            self.shipTimer = currentTime
             self.shipAlive = False
 
         if self.enemies.bottom >= 540:
-            sprite.groupcollide(self.enemies, self.playerGroup, True, True)
+            gridcollide(self.enemies, self.playerGroup, True, True)
             if not self.player.alive() or self.enemies.bottom >= 600:
                 self.gameOver = True
-                self.startGame = False
 
-        sprite.groupcollide(self.bullets, self.allBlockers, True, True)
-        sprite.groupcollide(self.enemyBullets, self.allBlockers, True, True)
+        destroyed = None if self.events is NULL_EVENTS else []
+        shieldcollide(self.bullets, self.allBlockers, True, destroyed)
+        shieldcollide(self.enemyBullets, self.allBlockers, True, destroyed)
         if self.enemies.bottom >= BLOCKERS_POSITION:
-            sprite.groupcollide(self.enemies, self.allBlockers, False, True)
+            shieldcollide(self.enemies, self.allBlockers, False, destroyed)
+        if destroyed:
+            self.emit_shield_cells(destroyed)
+
+    def emit_shield_cells(self, destroyed):
+        frame = self.clock.frame
+        for shield, row, cells in destroyed:
+            for rect in shield.cell_rects(row, cells):
+                self.events.emit(SHIELD_CELL_DESTROYED, frame,
+                                 shield.rect.x + rect.x,
+                                 shield.rect.y + rect.y, rect.width)
 
     def create_new_ship(self, createShip, currentTime):
         if createShip and (currentTime - self.shipTimer > 900):
             self.player = Ship()
-            self.allSprites.add(self.player)
             self.playerGroup.add(self.player)
             self.makeNewShip = False
             self.shipAlive = True
 
-    def create_game_over(self, currentTime):
+
+class Renderer(object):
+    def __init__(self, screen, dirty=False):
+        self.screen = screen
+        # In dirty mode only the regions that changed since the last frame
+        # are restored and pushed to the display
+        self.dirty = dirty
+        self.dirtyRects = None
+        self.staticLayer = None
+        self.background = image.load(IMAGE_PATH + 'background.jpg').convert()
+        self.titleText = Text(FONT, 50, 'Space Invaders', WHITE, 164, 155)
+        self.titleText2 = Text(FONT, 25, 'Press any key to continue', WHITE,
+                               201, 225)
+        self.gameOverText = Text(FONT, 50, 'Game Over', WHITE, 250, 270)
+        self.nextRoundText = Text(FONT, 50, 'Next Round', WHITE, 240, 270)
+        self.enemy1Text = Text(FONT, 25, '   =   10 pts', GREEN, 368, 270)
+        self.enemy2Text = Text(FONT, 25, '   =  20 pts', BLUE, 368, 320)
+        self.enemy3Text = Text(FONT, 25, '   =  30 pts', PURPLE, 368, 370)
+        self.enemy4Text = Text(FONT, 25, '   =  ?????', RED, 368, 420)
+        self.scoreText = Text(FONT, 20, 'Score', WHITE, 5, 5)
+        self.livesText = Text(FONT, 20, 'Lives ', WHITE, 640, 5)
+
+        self.life1 = Life(715, 3)
+        self.life2 = Life(742, 3)
+        self.life3 = Life(769, 3)
+        self.lifeSprites = [self.life1, self.life2, self.life3]
+        self.hud = None
+        self.hudState = None
+        self.frames = {}
+        self.blockers = None
+        self.shieldCells = []
+        self.roundOver = False
+        self.overlay = None
+        self.overlayDirty = []
+
+    def create_main_menu(self):
+        self.enemy1 = atlas_image('enemy3_1', (40, 40))
+        self.enemy2 = atlas_image('enemy2_2', (40, 40))
+        self.enemy3 = atlas_image('enemy1_2', (40, 40))
+        self.enemy4 = atlas_image('mystery', (80, 40))
+        self.screen.blit(self.enemy1, (318, 270))
+        self.screen.blit(self.enemy2, (318, 320))
+        self.screen.blit(self.enemy3, (318, 370))
+        self.screen.blit(self.enemy4, (299, 420))
+
+    def invalidate(self):
+        self.staticLayer = None
+        self.dirtyRects = None
+
+    def update_display(self):
+        if self.dirtyRects is None:
+            display.update()
+        elif self.dirtyRects:
+            display.update(self.dirtyRects)
+
+    def draw_main_menu(self):
+        self.invalidate()
+        self.screen.blit(self.background, (0, 0))
+        self.titleText.draw(self.screen)
+        self.titleText2.draw(self.screen)
+        self.enemy1Text.draw(self.screen)
+        self.enemy2Text.draw(self.screen)
+        self.enemy3Text.draw(self.screen)
+        self.enemy4Text.draw(self.screen)
+        self.create_main_menu()
+
+    def update_hud(self, game):
+        # The HUD is composed once into its own surface and only rebuilt
+        # when the score or lives change
+        state = (game.score, game.lives)
+        if state == self.hudState:
+            return False
+        self.hudState = state
+        if self.hud is None:
+            self.hud = Surface((self.screen.get_width(), 30), SRCALPHA)
+        self.hud.fill((0, 0, 0, 0))
+        self.scoreText2 = Text(FONT, 20, str(game.score), GREEN, 85, 5)
+        self.scoreText.draw(self.hud)
+        self.scoreText2.draw(self.hud)
+        self.livesText.draw(self.hud)
+        for life in self.lifeSprites[:game.lives]:
+            self.hud.blit(life.image, life.rect)
+        return True
+
+    def draw_hud(self, game):
+        self.update_hud(game)
+        self.screen.blit(self.hud, (0, 0))
+
+    def set_overlay(self, rows):
+        # Debug table drawn over the game, e.g. the frame profiler report;
+        # the first column is left aligned and the rest right aligned
+        old = self.overlay
+        self.overlay = None
+        if rows:
+            textFont = get_font(FONT, PROFILER_FONT_SIZE)
+            lineHeight = textFont.get_linesize()
+            cells = [[textFont.render(text, False, WHITE) for text in row]
+                     for row in rows]
+            nameWidth = max(row[0].get_width() for row in cells) + 10
+            columnWidth = max(cell.get_width()
+                              for row in cells for cell in row[1:]) + 10
+            columns = max(len(row) for row in cells) - 1
+            surface = Surface((nameWidth + columnWidth * columns + 10,
+                               lineHeight * len(rows) + 10), SRCALPHA)
+            surface.fill((0, 0, 0, 160))
+            for i, row in enumerate(cells):
+                ypos = 5 + i * lineHeight
+                surface.blit(row[0], (5, ypos))
+                for j, cell in enumerate(row[1:]):
+                    right = 5 + nameWidth + columnWidth * (j + 1)
+                    surface.blit(cell, (right - cell.get_width(), ypos))
+            rect = surface.get_rect(topright=(self.screen.get_width() - 5, 35))
+            self.overlay = surface, rect
+        self.overlayDirty = [item[1] for item in (old, self.overlay) if item]
+
+    def draw_overlay(self):
+        if self.overlay is not None:
+            self.screen.blit(*self.overlay)
+
+    @staticmethod
+    def sprite_positions(game):
+        # Where the gliding sprites are, to interpolate from after a step;
+        # the formation moves in jumps and is always drawn where it is
+        return dict((s, s.rect.topleft)
+                    for group in (game.playerGroup, game.mysteryGroup,
+                                  game.bullets, game.enemyBullets)
+                    for s in group)
+
+    @staticmethod
+    def sprite_frames(game, alpha=1.0, previous=None):
+        # Everything that moves, in draw order, as (image, rect) pairs. With
+        # the positions from before the last step, sprites are drawn alpha
+        # of the way from there to where they are now.
+        for group in (game.playerGroup, game.enemies, game.mysteryGroup,
+                      game.bullets, game.enemyBullets):
+            if group is game.enemies:
+                for frame in group.frames():
+                    yield frame
+                continue
+            if previous is None:
+                for s in group:
+                    yield s.image, s.rect
+                continue
+            for s in group:
+                rect = s.rect
+                old = previous.get(s)
+                if old is not None:
+                    dx = old[0] - rect.x
+                    dy = old[1] - rect.y
+                    if abs(dx) <= MAX_STEP_DISTANCE and \
+                            abs(dy) <= MAX_STEP_DISTANCE:
+                        rect = rect.move(round(dx * (1 - alpha)),
+                                         round(dy * (1 - alpha)))
+                yield s.image, rect
+        for explosion in game.explosionsGroup:
+            frame = explosion.frame()
+            if frame:
+                yield frame
+
+    def draw_game(self, game, alpha=1.0, previous=None):
+        if self.dirty and self.staticLayer is not None and \
+                game.allBlockers is self.blockers and \
+                game.is_round_over() == self.roundOver:
+            self.draw_game_dirty(game, alpha, previous)
+            return
+        self.dirtyRects = None
+        self.screen.blit(self.background, (0, 0))
+        self.roundOver = game.is_round_over()
+        if self.roundOver:
+            self.draw_hud(game)
+            self.nextRoundText.draw(self.screen)
+        else:
+            game.allBlockers.draw(self.screen)
+            self.draw_hud(game)
+            self.screen.blits(self.sprite_frames(game, alpha, previous),
+                              doreturn=False)
+        self.draw_overlay()
+        self.overlayDirty = []
+        if self.dirty:
+            self.staticLayer = self.background.copy()
+            game.allBlockers.draw(self.staticLayer)
+            self.blockers = game.allBlockers
+            self.shieldCells = [list(shield.cells)
+                                for shield in game.allBlockers]
+            self.frames = dict(((id(img), tuple(rect)), (img, Rect(rect)))
+                               for img, rect in self.sprite_frames(
+                                   game, alpha, previous))
+
+    def draw_game_dirty(self, game, alpha=1.0, previous=None):
+        dirty = self.overlayDirty
+        self.overlayDirty = []
+        if self.update_hud(game):
+            dirty.append(self.hud.get_rect())
+        if self.roundOver:
+            frames = {}
+            items = [(self.hud, self.hud.get_rect()),
+                     (self.nextRoundText.surface, self.nextRoundText.rect)]
+        else:
+            for shield, cells in zip(game.allBlockers, self.shieldCells):
+                if shield.cells == cells:
+                    continue
+                if any(new & ~old for old, new in zip(cells, shield.cells)):
+                    # Cells brought back by a restore are missing from the
+                    # static layer
+                    self.staticLayer = None
+                    self.draw_game(game, alpha, previous)
+                    return
+                for row, (old, new) in enumerate(zip(cells, shield.cells)):
+                    for rect in shield.cell_rects(row, old & ~new):
+                        rect.move_ip(shield.rect.topleft)
+                        self.staticLayer.blit(self.background, rect, rect)
+                        dirty.append(rect)
+                cells[:] = shield.cells
+
+            frames = dict(((id(img), tuple(rect)), (img, rect))
+                          for img, rect in self.sprite_frames(
+                              game, alpha, previous))
+            for key, (img, rect) in self.frames.items():
+                if key not in frames:
+                    dirty.append(rect)
+            for key, (img, rect) in frames.items():
+                if key not in self.frames:
+                    dirty.append(Rect(rect))
+            items = [(self.hud, self.hud.get_rect())] + list(frames.values())
+
+        self.dirtyRects = dirty
+        if not dirty:
+            return
+        if self.overlay is not None:
+            items.append(self.overlay)
+        if len(dirty) > MAX_DIRTY_RECTS:
+            # Restoring region by region would cost more than a full frame
+            self.dirtyRects = None
+            self.screen.blit(self.staticLayer, (0, 0))
+            self.screen.blits(items, doreturn=False)
+        else:
+            self.restore_regions(dirty, items)
+        if not self.roundOver:
+            self.frames = dict((key, (img, Rect(rect)))
+                               for key, (img, rect) in frames.items())
+
+    def restore_regions(self, dirty, items):
+        rects = [rect for img, rect in items]
+        # Each region is restored and everything overlapping it redrawn,
+        # clipped so translucent edges are never blended twice
+        for area in dirty:
+            self.screen.set_clip(area)
+            self.screen.blit(self.staticLayer, area, area)
+            for i in area.collidelistall(rects):
+                self.screen.blit(*items[i])
+        self.screen.set_clip(None)
+
+    def draw_game_over(self, passed):
+        self.invalidate()
         self.screen.blit(self.background, (0, 0))
-        passed = currentTime - self.timer
         if passed < 750:
             self.gameOverText.draw(self.screen)
-        elif 750 < passed < 1500:
-            self.screen.blit(self.background, (0, 0))
         elif 1500 < passed < 2250:
             self.gameOverText.draw(self.screen)
-        elif 2250 < passed < 2750:
-            self.screen.blit(self.background, (0, 0))
-        elif passed > 3000:
+
+
+class App(object):
+    def __init__(self, dirty=False, profiler=None, seed=None, sound=True,
+                 turbo=False, frame_skip=1, action_repeat=1, refresh=FPS,
+                 waves=None, events=None, autopilot=None):
+        # Only the subsystems the window needs; init() would also bring up
+        # joysticks
+        display.init()
+        font.init()
+        self.audio = NULL_AUDIO
+        if sound:
+            try:
+                self.audio = MixerAudio()
+            except error:
+                # No audio device; play on without sound
+                pass
+        self.clock = time.Clock()
+        self.screen = display.set_mode((800, 600))
+        self.caption = display.set_caption('Space Invaders')
+        convert_images()
+        self.renderer = Renderer(self.screen, dirty)
+        self.game = SpaceInvaders(seed=seed, audio=self.audio, waves=waves,
+                                  events=events)
+        # Replaces the game's step() and new_game() while recording
+        self.recorder = None
+        self.startGame = False
+        self.mainScreen = True
+        self.gameOver = False
+        self.timer = time.get_ticks()
+        # The game always steps 1/FPS of game time; turbo steps as fast as
+        # possible, otherwise steps are paced by real time. Either way the
+        # game is drawn once every frame_skip steps, and at refresh frames
+        # per second positions are interpolated between steps.
+        self.turbo = turbo
+        self.frameSkip = frame_skip
+        self.actionRepeat = action_repeat
+        self.refresh = refresh
+        self.interpolate = not turbo and refresh != FPS
+        self.lag = 0.0  # Milliseconds of real time not yet simulated
+        self.previous = None
+        self.action = ACTION_NONE
+        self.fire = ACTION_NONE
+        self.repeatLeft = 0
+        # A policy(game, frame) -> action playing instead of the keyboard
+        self.autopilot = autopilot
+        self.profiler = profiler
+        self.showProfiler = True
+        if profiler is not None:
+            self.game.set_profiler(profiler, end_frames=False)
+            profiler.instrument(self, ('check_input',), 'app_')
+            profiler.instrument(self.renderer, ('draw_game', 'update_display'))
+
+    @staticmethod
+    def should_exit(evt):
+        # type: (pygame.event.EventType) -> bool
+        return evt.type == QUIT or (evt.type == KEYUP and evt.key == K_ESCAPE)
+
+    def check_input(self):
+        keys = key.get_pressed()
+        action = ACTION_NONE
+        if keys[K_LEFT]:
+            action |= ACTION_LEFT
+        if keys[K_RIGHT]:
+            action |= ACTION_RIGHT
+        for e in event.get():
+            if self.should_exit(e):
+                sys.exit()
+            if e.type == KEYDOWN and e.key == K_SPACE:
+                action |= ACTION_FIRE
+            if e.type == KEYDOWN and e.key == K_F3 and self.profiler:
+                self.showProfiler = not self.showProfiler
+                if not self.showProfiler:
+                    self.renderer.set_overlay(None)
+        return action
+
+    def end_profiled_frame(self):
+        # Closes a game frame once it is on screen; the overlay is refreshed
+        # twice a second so it stays readable and cheap
+        profiler = self.profiler
+        profiler.end_frame(self.game.sprite_counts())
+        if self.showProfiler and profiler.frame % (FPS // 2) == 0:
+            self.renderer.set_overlay(profiler.report_rows())
+
+    def start_game(self):
+        (self.recorder or self.game).new_game()
+        self.startGame = True
+        self.mainScreen = False
+        self.lag = 0.0
+        self.previous = None
+        self.fire = ACTION_NONE
+        self.repeatLeft = 0
+
+    def play_frame(self):
+        # Runs the steps that are due, then draws the game once
+        if self.turbo:
+            steps = self.frameSkip
+        else:
+            self.lag += self.clock.get_time()
+            steps = int(self.lag * FPS // 1000)
+            limit = MAX_CATCH_UP_STEPS * self.frameSkip
+            if steps > limit:
+                steps = limit
+                self.lag = 0.0
+            else:
+                self.lag -= steps * 1000.0 / FPS
+
+        # Held keys count for every step, a shot waits for the next step
+        action = self.check_input()
+        held = action & ~ACTION_FIRE
+        self.fire |= action & ACTION_FIRE
+        game = self.recorder or self.game
+        for i in range(steps):
+            if self.repeatLeft == 0:
+                if self.autopilot is not None:
+                    self.action = self.autopilot(self.game,
+                                                 self.game.clock.frame)
+                else:
+                    self.action = held | self.fire
+                    self.fire = ACTION_NONE
+                self.repeatLeft = self.actionRepeat
+            self.repeatLeft -= 1
+            if self.interpolate and i == steps - 1:
+                self.previous = self.renderer.sprite_positions(self.game)
+            game.step(self.action)
+            if self.game.gameOver:
+                self.startGame = False
+                self.gameOver = True
+                self.timer = time.get_ticks()
+                break
+
+        if self.interpolate:
+            alpha = min(self.lag * FPS / 1000.0, 1.0)
+            self.renderer.draw_game(self.game, alpha, self.previous)
+        else:
+            self.renderer.draw_game(self.game)
+
+    def create_game_over(self, currentTime):
+        passed = currentTime - self.timer
+        self.renderer.draw_game_over(passed)
+        if passed > 3000:
             self.mainScreen = True
+            self.gameOver = False
 
         for e in event.get():
             if self.should_exit(e):
@@ -526,74 +1747,111 @@ class SpaceInvaders(object):
 
     def main(self):
         while True:
+            playing = self.startGame
             if self.mainScreen:
-                self.screen.blit(self.background, (0, 0))
-                self.titleText.draw(self.screen)
-                self.titleText2.draw(self.screen)
-                self.enemy1Text.draw(self.screen)
-                self.enemy2Text.draw(self.screen)
-                self.enemy3Text.draw(self.screen)
-                self.enemy4Text.draw(self.screen)
-                self.create_main_menu()
+                self.renderer.draw_main_menu()
                 for e in event.get():
                     if self.should_exit(e):
                         sys.exit()
                     if e.type == KEYUP:
-                        # Only create blockers on a new game, not a new round
-                        self.allBlockers = sprite.Group(self.make_blockers(0),
-                                                        self.make_blockers(1),
-                                                        self.make_blockers(2),
-                                                        self.make_blockers(3))
-                        self.livesGroup.add(self.life1, self.life2, self.life3)
-                        self.reset(0)
-                        self.startGame = True
-                        self.mainScreen = False
+                        self.start_game()
 
             elif self.startGame:
-                if not self.enemies and not self.explosionsGroup:
-                    currentTime = time.get_ticks()
-                    if currentTime - self.gameTimer < 3000:
-                        self.screen.blit(self.background, (0, 0))
-                        self.scoreText2 = Text(FONT, 20, str(self.score),
-                                               GREEN, 85, 5)
-                        self.scoreText.draw(self.screen)
-                        self.scoreText2.draw(self.screen)
-                        self.nextRoundText.draw(self.screen)
-                        self.livesText.draw(self.screen)
-                        self.livesGroup.update()
-                        self.check_input()
-                    if currentTime - self.gameTimer > 3000:
-                        # Move enemies closer to bottom
-                        self.enemyPosition += ENEMY_MOVE_DOWN
-                        self.reset(self.score)
-                        self.gameTimer += 3000
-                else:
-                    currentTime = time.get_ticks()
-                    self.screen.blit(self.background, (0, 0))
-                    self.allBlockers.update(self.screen)
-                    self.scoreText2 = Text(FONT, 20, str(self.score), GREEN,
-                                           85, 5)
-                    self.scoreText.draw(self.screen)
-                    self.scoreText2.draw(self.screen)
-                    self.livesText.draw(self.screen)
-                    self.check_input()
-                    self.enemies.update(currentTime)
-                    self.allSprites.update(self.keys, currentTime)
-                    self.explosionsGroup.update(currentTime)
-                    self.check_collisions()
-                    self.create_new_ship(self.makeNewShip, currentTime)
-                    self.make_enemies_shoot()
+                self.play_frame()
 
             elif self.gameOver:
-                currentTime = time.get_ticks()
-                # Reset enemy starting position
-                self.enemyPosition = ENEMY_DEFAULT_POSITION
-                self.create_game_over(currentTime)
+                self.create_game_over(time.get_ticks())
 
-            display.update()
-            self.clock.tick(60)
+            self.renderer.update_display()
+            if self.profiler is not None:
+                if playing:
+                    self.end_profiled_frame()
+                else:
+                    self.profiler.discard_frame()
+            # Frame skip only applies to play; menus keep the refresh rate
+            if self.turbo and self.startGame:
+                self.clock.tick()
+            elif self.startGame:
+                self.clock.tick(self.refresh / float(self.frameSkip))
+            else:
+                self.clock.tick(self.refresh)
 
 
 if __name__ == '__main__':
-    game = SpaceInvaders()
-    game.main()
+    import argparse
+    parser = argparse.ArgumentParser(description='Space Invaders')
+    parser.add_argument('--dirty', action='store_true',
+                        help='only redraw the parts of the screen that change')
+    parser.add_argument('--mute', action='store_true',
+                        help='do not open the audio device')
+    parser.add_argument('--seed', type=int,
+                        help='seed for the enemy shots and mystery scores')
+    parser.add_argument('--turbo', action='store_true',
+                        help='simulate as fast as possible instead of in '
+                             'real time')
+    parser.add_argument('--frame-skip', type=int, default=1, metavar='N',
+                        help='draw only every Nth simulated frame')
+    parser.add_argument('--action-repeat', type=int, default=1, metavar='N',
+                        help='read the controls once every N frames')
+    parser.add_argument('--refresh', type=float, default=FPS, metavar='HZ',
+                        help='frames drawn per second, interpolated between '
+                             'steps when it is not %(default)s')
+    parser.add_argument('--waves', metavar='PATH',
+                        help='play the formations defined in PATH')
+    parser.add_argument('--autopilot', action='store_true',
+                        help='let the built-in autopilot play')
+    parser.add_argument('--events', metavar='PATH',
+                        help='append gameplay events to PATH, as JSON lines '
+                             'if it ends in .jsonl and binary otherwise')
+    parser.add_argument('--record', metavar='PATH',
+                        help='save a replay of the session to PATH on exit')
+    parser.add_argument('--profile', action='store_true',
+                        help='time each phase of the frame and show the '
+                             'results over the game (F3 toggles)')
+    parser.add_argument('--profile-out', metavar='PATH',
+                        help='stream per-frame timings to PATH, as CSV if it '
+                             'ends in .csv and JSON lines otherwise')
+    args = parser.parse_args()
+    profiler = None
+    stream = None
+    if args.profile or args.profile_out:
+        from frameprofiler import FrameProfiler
+        if args.profile_out:
+            stream = open(args.profile_out, 'w', newline='')
+        profiler = FrameProfiler(
+            stream=stream,
+            fmt='csv' if str(args.profile_out).endswith('.csv') else 'json')
+    seed = args.seed
+    if args.record and seed is None:
+        seed = Random().getrandbits(32)
+    if args.frame_skip < 1 or args.action_repeat < 1 or args.refresh <= 0:
+        parser.error('--frame-skip, --action-repeat and --refresh must be '
+                     'positive')
+    if args.record and args.waves:
+        parser.error('replays are always of the default waves')
+    if args.record and not 0 <= seed < 1 << 64:
+        parser.error('recorded seeds must be in [0, 2**64)')
+    app = App(dirty=args.dirty, profiler=profiler, seed=seed,
+              sound=not args.mute, turbo=args.turbo,
+              frame_skip=args.frame_skip, action_repeat=args.action_repeat,
+              refresh=args.refresh,
+              waves=load_waves(args.waves) if args.waves else None,
+              events=EventStream(args.events) if args.events else None)
+    if args.autopilot:
+        from autopilot import Autopilot
+        app.autopilot = Autopilot()
+    app.showProfiler = args.profile
+    if args.record:
+        from replay import Recorder
+        app.recorder = Recorder(app.game)
+    try:
+        app.main()
+    finally:
+        if args.profile:
+            print('\n'.join(profiler.report_lines()))
+        if stream is not None:
+            stream.close()
+        app.game.events.close()
+        if app.recorder is not None:
+            app.recorder.save(args.record)
+        app.audio.quit()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# Vector environment
+# Runs many headless games across worker processes. Actions, observations,
+# rewards and done flags live in shared memory arrays that the workers read
+# and write in place; the pipes to the workers only carry one byte commands.
+# A game that ends is started again straight away, and the observation
+# returned for it is the first one of the new game.
+#
+#   env = VectorEnv(64, workers=8)
+#   obs = env.reset()
+#   obs, rewards, dones = env.step(actions)       # sync
+#
+#   env.send(actions)                             # async
+#   ids, obs, rewards, dones = env.recv()         # whichever workers are done
+#   env.send(actions_for_ids, ids)
+
+import multiprocessing
+import numpy as np
+from multiprocessing import connection, shared_memory
+
+from observations import SymbolicEncoder
+from spaceinvaders import SpaceInvaders
+
+STEP = b's'
+RESET = b'r'
+CLOSE = b'c'
+
+
+def shared_array(shape, dtype, name=None):
+    # Creates the block when no name is given, attaches to it otherwise
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if name is None:
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    else:
+        block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype, buffer=block.buf)
+
+
+def worker(conn, specs, start, stop, seed):
+    blocks = []
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        block, arrays[key] = shared_array(shape, dtype, name)
+        blocks.append(block)
+    actions = arrays['actions']
+    rewards = arrays['rewards']
+    dones = arrays['dones']
+    games = [SpaceInvaders(seed=seed + i) for i in range(start, stop)]
+    encoders = [SymbolicEncoder(game, arrays['observations'][i])
+                for i, game in enumerate(games, start)]
+    try:
+        while True:
+            command = conn.recv_bytes()
+            if command == CLOSE:
+                break
+            for i, game, encoder in zip(range(start, stop), games, encoders):
+                if command == RESET:
+                    game.new_game()
+                    reward, done = 0, False
+                else:
+                    reward, done = game.step(int(actions[i]))
+                    if done:
+                        game.new_game()
+                rewards[i] = reward
+                dones[i] = done
+                encoder.encode(game)
+            conn.send_bytes(command)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del actions, rewards, dones, arrays, encoders
+        for block in blocks:
+            block.close()
+
+
+class VectorEnv(object):
+    def __init__(self, size, workers=None, seed=0, context=None):
+        workers = min(size, workers or multiprocessing.cpu_count())
+        self.size = size
+        self.observationSize = SymbolicEncoder(SpaceInvaders()).size
+        shapes = {'actions': ((size,), np.uint8),
+                  'observations': ((size, self.observationSize), np.float32),
+                  'rewards': ((size,), np.int32),
+                  'dones': ((size,), np.bool_)}
+        self.blocks = []
+        specs = {}
+        for key, (shape, dtype) in shapes.items():
+            block, array = shared_array(shape, dtype)
+            self.blocks.append(block)
+            setattr(self, key, array)
+            specs[key] = (block.name, shape, dtype)
+
+        # Contiguous slices of games, as even as possible
+        context = multiprocessing.get_context(context)
+        bounds = [size * i // workers for i in range(workers + 1)]
+        self.slices = list(zip(bounds[:-1], bounds[1:]))
+        self.pipes = []
+        self.processes = []
+        for start, stop in self.slices:
+            parent, child = context.Pipe()
+            process = context.Process(target=worker,
+                                      args=(child, specs, start, stop, seed),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+        self.waiting = set()
+        self.closed = False
+
+    def workers_for(self, ids):
+        ids = set(int(i) for i in ids)
+        found = []
+        for worker, (start, stop) in enumerate(self.slices):
+            covered = ids.intersection(range(start, stop))
+            if covered and len(covered) != stop - start:
+                raise ValueError('games {}-{} run in one worker and must be '
+                                 'stepped together'.format(start, stop - 1))
+            if covered:
+                found.append(worker)
+        return found
+
+    def command(self, command, workers):
+        for worker in workers:
+            if worker in self.waiting:
+                raise RuntimeError('worker {} is still stepping'.format(
+                    worker))
+            self.pipes[worker].send_bytes(command)
+            self.waiting.add(worker)
+
+    def reset(self):
+        self.recv(everything=True)
+        self.command(RESET, range(len(self.pipes)))
+        self.recv(everything=True)
+        return self.observations
+
+    def send(self, actions, ids=None):
+        # Starts stepping the given games, all of them by default, with
+        # actions holding one action per game in ids
+        if ids is None:
+            self.actions[:] = actions
+            workers = range(len(self.pipes))
+        else:
+            self.actions[ids] = actions
+            workers = self.workers_for(ids)
+        self.command(STEP, workers)
+
+    def recv(self, everything=False):
+        # Waits for at least one stepping worker, or for all of them, and
+        # returns the ids of the games they ran with their results
+        finished = []
+        pending = dict((self.pipes[worker], worker) for worker in self.waiting)
+        while pending and (everything or not finished):
+            for pipe in connection.wait(list(pending)):
+                pipe.recv_bytes()
+                worker = pending.pop(pipe)
+                self.waiting.discard(worker)
+                finished.append(worker)
+        ids = np.concatenate([np.arange(*self.slices[worker])
+                              for worker in sorted(finished)] or [[]]
+                             ).astype(np.intp)
+        return (ids, self.observations[ids], self.rewards[ids],
+                self.dones[ids])
+
+    def step(self, actions):
+        # Returns views of the shared arrays, overwritten by the next step
+        self.send(actions)
+        self.recv(everything=True)
+        return self.observations, self.rewards, self.dones
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.recv(everything=True)
+        for pipe in self.pipes:
+            pipe.send_bytes(CLOSE)
+        for process in self.processes:
+            process.join()
+        for pipe in self.pipes:
+            pipe.close()
+        del self.actions, self.observations, self.rewards, self.dones
+        for block in self.blocks:
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                # A caller still holds a view; the mapping goes with it
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
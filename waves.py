@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Waves
+# The formations a game is played with, read from a JSON file and compiled
+# once into flat lookup tables: per row the sprite frames, explosion and
+# score, per column and row the offset of a cell in the formation, and the
+# move time for every possible number of enemies left. Building a round or
+# stepping the formation only indexes into these.
+#
+# File layout:
+#   start           formation top of the first round
+#   round_drop      added to the formation top every round
+#   mystery_scores  scores the mystery ship is worth, picked at random
+#   enemies         name -> {frames, explosion, score}
+#   waves           one per round, the last repeating; each has columns,
+#                   rows (enemy names, or [name, count] for a run of rows),
+#                   x, spacing [x, y], step, sweep, move_down, move_time and
+#                   tempo [[fewest, most enemies left, move time], ...],
+#                   later ranges overriding earlier ones
+
+import json
+from os.path import abspath, dirname
+
+WAVE_PATH = abspath(dirname(__file__)) + '/waves/'
+DEFAULT_WAVES = WAVE_PATH + 'default.json'
+ENEMY_WIDTH = 40
+ENEMY_HEIGHT = 35
+# Compiled tables by path, shared by every game using the same file
+WAVE_TABLES = {}
+
+
+class Wave(object):
+    def __init__(self, index, data, enemies):
+        self.index = index
+        self.columns = data['columns']
+        kinds = []
+        for entry in data['rows']:
+            if isinstance(entry, str):
+                kinds.append(entry)
+            else:
+                kinds.extend([entry[0]] * entry[1])
+        for kind in kinds:
+            if kind not in enemies:
+                raise ValueError('wave {} uses unknown enemy {!r}'.format(
+                    index, kind))
+        self.rows = len(kinds)
+        if not self.rows or self.columns < 1:
+            raise ValueError('wave {} has no enemies'.format(index))
+        self.kinds = kinds
+        self.rowFrames = [tuple(enemies[kind]['frames']) for kind in kinds]
+        self.rowExplosions = [enemies[kind]['explosion'] for kind in kinds]
+        self.rowScores = [enemies[kind]['score'] for kind in kinds]
+
+        self.x = data['x']
+        self.spacingX, self.spacingY = data['spacing']
+        self.columnOffsets = [column * self.spacingX
+                              for column in range(self.columns)]
+        self.rowOffsets = [row * self.spacingY for row in range(self.rows)]
+        self.height = self.rowOffsets[-1] + ENEMY_HEIGHT
+
+        self.step = data['step']
+        self.sweep = data['sweep']
+        # Extra moves per dead column at an edge, so the formation still
+        # reaches the side of the screen
+        self.addMove = max(self.spacingX // self.step, 1)
+        self.moveDown = data['move_down']
+
+        # Move time for every count of enemies left, from the tempo curve
+        size = self.rows * self.columns
+        self.moveTimes = [data['move_time']] * (size + 1)
+        for fewest, most, moveTime in data.get('tempo', ()):
+            for left in range(max(fewest, 0), min(most, size) + 1):
+                self.moveTimes[left] = moveTime
+
+        # The counters of a full formation, copied for every new round
+        full = (1 << self.columns) - 1
+        self.aliveMasks = [full] * self.rows
+        self.rowCounts = [self.columns] * self.rows
+        self.columnCounts = [self.rows] * self.columns
+
+
+class WaveTable(object):
+    def __init__(self, data):
+        self.start = data['start']
+        self.roundDrop = data['round_drop']
+        self.mysteryScores = list(data['mystery_scores'])
+        enemies = data['enemies']
+        self.waves = [Wave(index, wave, enemies)
+                      for index, wave in enumerate(data['waves'])]
+        if not self.waves:
+            raise ValueError('no waves defined')
+        # Every explosion any wave uses, so one can be stored as an index
+        self.explosions = sorted(set(enemies[kind]['explosion']
+                                     for kind in enemies))
+
+    def wave(self, number):
+        return self.waves[min(number, len(self.waves) - 1)]
+
+    def position(self, number):
+        # Formation top of a round
+        return self.start + number * self.roundDrop
+
+
+def load_waves(path=DEFAULT_WAVES):
+    if path not in WAVE_TABLES:
+        with open(path) as f:
+            WAVE_TABLES[path] = WaveTable(json.load(f))
+    return WAVE_TABLES[path]